@@ -3,10 +3,7 @@ import os
 import sys
 import logging
 
-import tree_sitter_python
-from tree_sitter import Language, Parser
-
-from aidocapp import model, utils
+from aidocapp import discovery, engine, gitdiff, journal, languages, prefilter, profiling, server
 
 
 def run():
@@ -22,55 +19,207 @@ def run():
         type=str,
         help="Path to the local model.",
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        help="Address of a running `python3 -m aidocapp.server`, used instead of loading a local model.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to parse files.",
+    )
+    parser.add_argument(
+        "--model_instances",
+        type=int,
+        default=1,
+        help="Number of model instances generating comments concurrently.",
+    )
+    parser.add_argument(
+        "--max_pending",
+        type=int,
+        default=8,
+        help="Maximum number of prompts waiting for a free model instance.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Maximum number of small functions documented with a single prompt, 1 disables batching.",
+    )
+    parser.add_argument(
+        "--batch_max_chars",
+        type=int,
+        default=1500,
+        help="Maximum combined size in characters of the functions packed into one prompt.",
+    )
+    parser.add_argument(
+        "--policy",
+        choices=prefilter.POLICIES,
+        default=prefilter.POLICY_MISSING,
+        help="Which functions to document: all of them, only the ones without a docstring (missing) "
+             "or also the ones whose docstring does not describe every argument and the return value (incomplete).",
+    )
+    parser.add_argument(
+        "--document_trivial",
+        action="store_true",
+        help="Also document functions with a single statement on at most two lines.",
+    )
+    parser.add_argument(
+        "--languages",
+        nargs="+",
+        choices=sorted(languages.LANGUAGES),
+        help="Languages to document, by default every language with an installed tree-sitter grammar.",
+    )
+    parser.add_argument(
+        "--diff",
+        type=str,
+        help="Git revision range, e.g. main...HEAD. Only functions touched by it are documented.",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        help="Glob pattern of files or directories to skip, can be given several times.",
+    )
+    parser.add_argument(
+        "--max_file_size",
+        type=int,
+        default=1024 * 1024,
+        help="Files larger than this many bytes are skipped, 0 disables the limit.",
+    )
+    parser.add_argument(
+        "--no_gitignore",
+        action="store_true",
+        help="Do not skip files matched by .gitignore files.",
+    )
+    parser.add_argument(
+        "--include_generated",
+        action="store_true",
+        help="Also document vendored directories and generated modules.",
+    )
+    parser.add_argument(
+        "--n_ctx",
+        type=int,
+        default=4096,
+        help="Context size of the local model in tokens. Larger functions only get a docstring.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream completions from the local model token by token.",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="File where finished comments are checkpointed, an interrupted run resumes from it. "
+             "Defaults to a file named after the target in the working directory.",
+    )
+    parser.add_argument(
+        "--no_journal",
+        action="store_true",
+        help="Do not checkpoint finished comments.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Write the time spent in every pipeline stage to this JSON file.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=".aidocapp_cache",
+        help="Directory of the cache with previously generated comments.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Always generate comments, without reading or updating the cache.",
+    )
 
     if sys.argv.__len__() < 4:
-        sys.exit("Please provide a file and path to the local model.")
+        sys.exit("Please provide a file and path to the local model or the model server.")
 
     args = parser.parse_args()
+
+    if args.local_model is None and args.server is None:
+        sys.exit("Please provide a file and path to the local model or the model server.")
     # print(args)
 
     logging.basicConfig(level=logging.INFO)
 
     path = args.file
 
-    file_list = {}
-    if os.path.isdir(path):
-        file_list = [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.py')]
-
-    elif os.path.isfile(path) and path.endswith('.py'):
-        file_list = {path}
-
-    model_wrapper = model.Model(local_model=args.local_model)
-
-    for file_name in file_list:
-        generated_comments = {}
-
-        logging.info("Processing \'{}\' file".format(file_name))
-
-        with open(file_name, "r") as file:
-            # Read the entire content of the file into a string
-            file_bytes = file.read().encode()
-            PY_LANGUAGE = Language(tree_sitter_python.language())
-
-            # Create a parser and set its language
-            parser = Parser(PY_LANGUAGE)
-
-            tree = parser.parse(file_bytes)
-            root_node = tree.root_node
-            extracted_elements = utils.extract_elements(root_node, file_bytes)
-
-            for element in extracted_elements:
-                method_source_code = ""
-                if element['type'] == 'function_definition':
-                    method_source_code = element['text']
-
-                # Add comment to the code
-                logging.info("Generating comments for \'{}\' method".format(method_source_code.partition('\n')[0]))
-                documented_method_source_code = model_wrapper.generate_comments(code=method_source_code, language="python")
-
-                generated_comments[method_source_code] = documented_method_source_code
-
-            file.close()
-
-        for original_code, generated_doc_comment in generated_comments.items():
-            utils.write_code_comments_to_file(file_name, original_code, generated_doc_comment)
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    for name in args.languages or ():
+        if not languages.LANGUAGES[name].is_available():
+            sys.exit("Grammar of {} is missing, please install the {} package.".format(
+                name, languages.LANGUAGES[name].module.replace("_", "-")))
+    extensions = languages.extensions(args.languages)
+
+    changed_lines = None
+    if args.diff is not None:
+        changed_lines = gitdiff.changed_lines(args.diff, cwd=path if os.path.isdir(path) else os.path.dirname(path) or ".")
+        root = os.path.realpath(path)
+        # Only changed files below the given path are parsed, the tree is not walked
+        file_list = (
+            file_name for file_name in sorted(changed_lines)
+            if (file_name == root or file_name.startswith(os.path.join(root, "")))
+            and os.path.isfile(file_name) and file_name.endswith(extensions)
+        )
+    else:
+        # Files are discovered lazily, so documentation starts while the tree is still walked
+        file_list = discovery.iter_source_files(
+            path,
+            extensions=extensions,
+            exclude=args.exclude + ([os.path.basename(os.path.normpath(cache_dir))] if cache_dir else []),
+            max_file_size=args.max_file_size or None,
+            use_gitignore=not args.no_gitignore,
+            skip_generated=not args.include_generated,
+        )
+
+    if args.server is not None:
+        # The server keeps the model loaded between runs, every instance here is one connection
+        remote = server.RemoteModel(args.server)
+        if not remote.is_alive():
+            sys.exit("Model server is not reachable at {}.".format(args.server))
+        models = [server.RemoteModel(args.server) for _ in range(max(args.model_instances, 1))]
+    else:
+        # Imported here so that clients of the model server do not pay for loading llama_cpp
+        from aidocapp import model
+
+        models = [
+            model.Model(local_model=args.local_model, cache_dir=cache_dir, stream=args.stream, n_ctx=args.n_ctx)
+            for _ in range(max(args.model_instances, 1))
+        ]
+
+    model_pool = engine.ModelPool(models)
+
+    profiling.enable(args.profile is not None)
+
+    run_journal = None if args.no_journal else journal.Journal(args.journal or journal.default_path(path))
+    completed = False
+    try:
+        functions_count = engine.document_files(
+            file_list,
+            model_pool,
+            workers=args.workers,
+            max_pending=args.max_pending,
+            batch_size=args.batch_size,
+            batch_max_chars=args.batch_max_chars,
+            policy=args.policy,
+            skip_trivial=not args.document_trivial,
+            changed_lines=changed_lines,
+            journal=run_journal,
+        )
+        completed = True
+    finally:
+        # The journal is only needed to resume an interrupted run
+        if run_journal is not None:
+            run_journal.close(remove=completed)
+
+    if args.profile is not None:
+        profiling.dump(args.profile, functions=functions_count)
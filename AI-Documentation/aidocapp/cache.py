@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+def model_identity(model_path: "str | None") -> str:
+    """Identifies a model file without hashing several gigabytes of weights."""
+    if model_path is None:
+        return ""
+
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return model_path
+
+    return "{}:{}:{}".format(os.path.basename(model_path), stat.st_size, stat.st_mtime_ns)
+
+
+class CommentCache:
+    """Persistent, content-addressed store of generated comments.
+
+    Every entry lives in its own file named after the hash of the function
+    source, the prompt template and the model identity, so concurrent writers
+    never touch the same file and a changed function simply misses.
+    """
+
+    def __init__(self, cache_dir: str, template, model_id: str):
+        self.cache_dir = cache_dir
+        self._salt = json.dumps(template, sort_keys=True) + "\0" + model_id
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, code: str, language: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(self._salt.encode())
+        digest.update(b"\0" + language.encode() + b"\0")
+        digest.update(code.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, code: str, language: str) -> "str | None":
+        try:
+            with open(self._path(self.key(code, language)), "r", encoding="utf-8") as file:
+                comment = json.load(file)["comment"]
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return comment
+
+    def put(self, code: str, language: str, comment: str):
+        path = self._path(self.key(code, language))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump({"comment": comment}, file)
+        os.replace(tmp_path, path)
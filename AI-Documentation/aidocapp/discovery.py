@@ -0,0 +1,187 @@
+import fnmatch
+import logging
+import os
+import re
+
+# Directories that hold vendored, generated or tool managed code
+DEFAULT_EXCLUDE_DIRS = (
+    ".git", ".hg", ".svn", ".tox", ".nox", ".eggs", ".venv", "venv", "env",
+    "__pycache__", "node_modules", "site-packages", "third_party", "vendor",
+    "build", "dist", ".aidocapp_cache",
+)
+
+# File name patterns of generated python modules
+DEFAULT_EXCLUDE_FILES = ("*_pb2.py", "*_pb2_grpc.py", "*_pb2.pyi")
+
+GENERATED_MARKERS = (b"@generated", b"do not edit", b"# generated by", b"autogenerated", b"auto-generated")
+
+
+class IgnoreRules:
+    """Patterns of a single `.gitignore` file, matched relative to its directory."""
+
+    def __init__(self, base_dir: str, lines):
+        self.base_dir = base_dir
+        self._rules = []
+
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            # A pattern with a slash anywhere but at the end is anchored to base_dir
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+
+            self._rules.append((_compile(line, anchored), negate, dir_only))
+
+    @classmethod
+    def from_file(cls, path: str):
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                return cls(os.path.dirname(path), file.readlines())
+        except OSError:
+            return None
+
+    def match(self, path: str, is_dir: bool) -> "bool | None":
+        """Returns True if ignored, False if re-included and None if no rule applies."""
+        rel_path = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+        result = None
+        # The last matching rule wins, as in git
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                result = not negate
+        return result
+
+
+def _compile(pattern: str, anchored: bool):
+    parts = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("/**", index) and index + 3 == len(pattern):
+            parts.append("/.*")
+            index += 3
+        elif pattern[index] == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            parts.append("[^/]")
+            index += 1
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return re.compile(prefix + "".join(parts) + r"\Z")
+
+
+def is_generated(file_path: str, head_size: int = 1024) -> bool:
+    """Checks the head of a file for the usual markers of generated code."""
+    try:
+        with open(file_path, "rb") as file:
+            head = file.read(head_size).lower()
+    except OSError:
+        return False
+
+    return any(marker in head for marker in GENERATED_MARKERS)
+
+
+def iter_source_files(
+        path: str,
+        extensions=(".py",),
+        exclude=(),
+        max_file_size: "int | None" = 1024 * 1024,
+        use_gitignore: bool = True,
+        skip_generated: bool = True,
+):
+    """Yields source files below a path while the tree is still being walked.
+
+    Directories are visited depth first in sorted order with an explicit
+    stack, so the first files are available to the caller immediately.
+
+    Args:
+        path (str): File or directory to search.
+        extensions (tuple): File name suffixes of the files to yield.
+        exclude: Extra glob patterns, matched against file and directory names
+            and against paths relative to `path`.
+        max_file_size (int | None): Files larger than this many bytes are skipped.
+        use_gitignore (bool): Honour `.gitignore` files found during the walk.
+        skip_generated (bool): Skip vendored directories and generated modules.
+
+    Yields:
+        str: Path of every file that should be documented.
+    """
+    if os.path.isfile(path):
+        if path.endswith(tuple(extensions)):
+            yield path
+        return
+
+    exclude = tuple(exclude)
+    if skip_generated:
+        exclude += DEFAULT_EXCLUDE_DIRS + DEFAULT_EXCLUDE_FILES
+
+    def excluded(entry_path, name):
+        rel_path = os.path.relpath(entry_path, path).replace(os.sep, "/")
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern) for pattern in exclude)
+
+    def ignored(rules, entry_path, is_dir):
+        result = None
+        # Rules of deeper directories take precedence
+        for rule in rules:
+            matched = rule.match(entry_path, is_dir)
+            if matched is not None:
+                result = matched
+        return bool(result)
+
+    stack = [(path, ())]
+    while stack:
+        directory, rules = stack.pop()
+
+        if use_gitignore:
+            rule = IgnoreRules.from_file(os.path.join(directory, ".gitignore"))
+            if rule is not None:
+                rules = rules + (rule,)
+
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.warning("Skipping directory \'{}\': {}".format(directory, e))
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if excluded(entry.path, entry.name):
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                if not ignored(rules, entry.path, True):
+                    subdirectories.append(entry.path)
+                continue
+
+            if not entry.name.endswith(tuple(extensions)) or not entry.is_file():
+                continue
+            if ignored(rules, entry.path, False):
+                continue
+            if max_file_size is not None and entry.stat().st_size > max_file_size:
+                logging.info("Skipping \'{}\': larger than {} bytes".format(entry.path, max_file_size))
+                continue
+            if skip_generated and is_generated(entry.path):
+                logging.info("Skipping generated file \'{}\'".format(entry.path))
+                continue
+
+            yield entry.path
+
+        # Reversed so that subdirectories are popped in sorted order
+        stack.extend((subdirectory, rules) for subdirectory in reversed(subdirectories))
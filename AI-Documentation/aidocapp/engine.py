@@ -0,0 +1,241 @@
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from aidocapp import gitdiff, prefilter, profiling, utils
+
+
+class ModelPool:
+    """Shares a fixed set of model instances between worker threads.
+
+    llama_cpp.Llama is not thread safe, so every instance is handed out to a
+    single thread at a time and returned once its completion has finished.
+    """
+
+    def __init__(self, models):
+        self.size = len(models)
+        self._models = queue.Queue()
+        for model_wrapper in models:
+            self._models.put(model_wrapper)
+
+    def generate_comments(self, code, language):
+        model_wrapper = self._models.get()
+        try:
+            return model_wrapper.generate_comments(code=code, language=language)
+        finally:
+            self._models.put(model_wrapper)
+
+    def generate_comments_batch(self, codes, language):
+        model_wrapper = self._models.get()
+        try:
+            return model_wrapper.generate_comments_batch(codes=codes, language=language)
+        finally:
+            self._models.put(model_wrapper)
+
+
+class Scheduler:
+    """Runs prompts on the model pool while bounding the number of queued ones."""
+
+    def __init__(self, model_pool: ModelPool, max_pending: int):
+        self.model_pool = model_pool
+        self._executor = ThreadPoolExecutor(max_workers=model_pool.size)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, code, language):
+        # Blocks the producer once max_pending prompts are waiting for a model
+        self._slots.acquire()
+        future = self._executor.submit(self.model_pool.generate_comments, code, language)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_batch(self, codes, language):
+        self._slots.acquire()
+        future = self._executor.submit(self.model_pool.generate_comments_batch, codes, language)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def _parse_file(file_name: str):
+    # A file that cannot be read or is not UTF-8 is skipped instead of ending the run
+    try:
+        return utils.parse_file(file_name)
+    except (OSError, UnicodeDecodeError) as error:
+        logging.warning("Skipping \'{}\' file: {}".format(file_name, error))
+        return file_name, []
+
+
+def _parsed_files(file_list, workers: int):
+    if workers <= 1:
+        yield from map(_parse_file, file_list)
+        return
+
+    # Executor.map would consume the whole file list up front, so files are submitted
+    # through a bounded window and parsing starts while discovery is still running
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for file_name in file_list:
+            window.append(executor.submit(_parse_file, file_name))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+
+        while window:
+            yield window.popleft().result()
+
+
+def _outermost(elements):
+    # A nested function is rewritten as part of its enclosing one, so it is not prompted on its own.
+    # Elements come in source order, an enclosing function before the functions inside it.
+    end_byte = -1
+    for element in elements:
+        if element['start_byte'] >= end_byte:
+            end_byte = element['end_byte']
+            yield element
+
+
+def _write_finished(pending: deque, wait: bool = False):
+    # Files are written in discovery order so that the output matches the serial path
+    while pending and (wait or all(future.done() for _, future, _ in pending[0][1])):
+        file_name, jobs = pending.popleft()
+
+        edits = [
+            (element, future.result() if index is None else future.result()[index])
+            for element, future, index in jobs
+        ]
+        if not edits:
+            continue
+        with profiling.stage("write"):
+            utils.write_code_comments_to_file(file_name, edits)
+
+
+def _submit_batches(scheduler: Scheduler, elements, batch_size: int, batch_max_chars: int):
+    # Small functions are packed together, large ones still get a request of their own
+    jobs = []
+    batch = []
+    batch_chars = 0
+
+    def flush():
+        if len(batch) == 1:
+            jobs.append((batch[0], scheduler.submit(batch[0]['text'], batch[0]['language']), None))
+        elif batch:
+            # Elements come from a single file, so a batch never mixes languages
+            future = scheduler.submit_batch([element['text'] for element in batch], batch[0]['language'])
+            jobs.extend((element, future, index) for index, element in enumerate(batch))
+        batch.clear()
+
+    for element in elements:
+        logging.info("Generating comments for \'{}\' method".format(element['text'].partition('\n')[0]))
+
+        if len(element['text']) > batch_max_chars:
+            jobs.append((element, scheduler.submit(element['text'], element['language']), None))
+            continue
+
+        if len(batch) == batch_size or batch_chars + len(element['text']) > batch_max_chars:
+            flush()
+            batch_chars = 0
+
+        batch.append(element)
+        batch_chars += len(element['text'])
+
+    flush()
+    return jobs
+
+
+def _resumed(comment):
+    future = Future()
+    future.set_result(comment)
+    return future
+
+
+def _checkpoint(journal, file_name, element, index, future):
+    if future.exception() is None:
+        journal.record(file_name, element, future.result() if index is None else future.result()[index])
+
+
+def document_files(
+        file_list,
+        model_pool: ModelPool,
+        workers: int = 1,
+        max_pending: int = 8,
+        batch_size: int = 1,
+        batch_max_chars: int = 1500,
+        policy: str = prefilter.POLICY_MISSING,
+        skip_trivial: bool = True,
+        changed_lines=None,
+        journal=None,
+):
+    """Parses files on a process pool and documents their functions concurrently.
+
+    Args:
+        file_list: Paths of the files to document, consumed lazily.
+        model_pool (ModelPool): Model instances used to generate comments.
+        workers (int): Number of processes used for parsing and extraction.
+        max_pending (int): Upper bound of prompts waiting for a free model.
+        batch_size (int): Maximum number of functions packed into one prompt, 1 disables batching.
+        batch_max_chars (int): Maximum size of the functions packed into one prompt.
+        policy (str): How functions with an existing docstring are treated, see `prefilter.POLICIES`.
+        skip_trivial (bool): Skip one-line functions instead of prompting for them.
+        changed_lines (dict | None): Changed line ranges per absolute file path, as returned
+            by `gitdiff.changed_lines`. When given, only functions overlapping them are documented.
+        journal (journal.Journal | None): Checkpoint of finished comments. Functions found in it
+            are not prompted again and every new comment is appended as soon as it completes.
+
+    Returns:
+        int: Number of functions that were documented.
+    """
+    scheduler = Scheduler(model_pool, max_pending=max(max_pending, model_pool.size))
+    pending = deque()
+    functions_count = 0
+    skipped_count = 0
+    start_time = time.perf_counter()
+
+    try:
+        for file_name, extracted_elements in _parsed_files(file_list, workers):
+            logging.info("Processing \'{}\' file".format(file_name))
+            elements = prefilter.filter_elements(extracted_elements, policy, skip_trivial)
+            if changed_lines is not None:
+                elements = gitdiff.filter_changed(elements, changed_lines.get(os.path.abspath(file_name), ()))
+            elements = list(_outermost(elements))
+            skipped_count += len(extracted_elements) - len(elements)
+
+            resumed_jobs = []
+            if journal is not None:
+                comments = [journal.get(file_name, element) for element in elements]
+                resumed_jobs = [(element, _resumed(comment), None)
+                                for element, comment in zip(elements, comments) if comment is not None]
+                elements = [element for element, comment in zip(elements, comments) if comment is None]
+
+            if batch_size > 1:
+                jobs = _submit_batches(scheduler, elements, batch_size, batch_max_chars)
+            else:
+                jobs = []
+                for element in elements:
+                    logging.info("Generating comments for \'{}\' method".format(element['text'].partition('\n')[0]))
+                    jobs.append((element, scheduler.submit(element['text'], element['language']), None))
+
+            if journal is not None:
+                for element, future, index in jobs:
+                    future.add_done_callback(functools.partial(_checkpoint, journal, file_name, element, index))
+
+            functions_count += len(jobs) + len(resumed_jobs)
+            pending.append((file_name, resumed_jobs + jobs))
+            _write_finished(pending)
+
+        _write_finished(pending, wait=True)
+    finally:
+        scheduler.shutdown()
+
+    elapsed = time.perf_counter() - start_time
+    profiling.record("total", elapsed)
+    logging.info("Documented {} functions in {:.2f}s ({:.2f} functions/s)".format(
+        functions_count, elapsed, functions_count / elapsed if elapsed > 0 else 0.0))
+    logging.info("Skipped {} functions that did not need a prompt".format(skipped_count))
+
+    return functions_count
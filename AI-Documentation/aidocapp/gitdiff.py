@@ -0,0 +1,78 @@
+import codecs
+import logging
+import os
+import re
+import subprocess
+
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def _git(args, cwd: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "core.quotepath=off"] + args,
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+    ).stdout
+
+
+def _target_path(line: str) -> "str | None":
+    # Path of a `+++ ` line, git ends names with spaces in a tab and C-quotes unusual ones
+    target = line[4:].rstrip("\t")
+    if target.startswith('"') and target.endswith('"'):
+        target = codecs.escape_decode(target[1:-1].encode("utf-8"))[0].decode("utf-8")
+    if target == "/dev/null":
+        return None
+    return target[2:] if target.startswith("b/") else target
+
+
+def changed_lines(rev_range: str, cwd: str = "."):
+    """Collects the lines touched by a revision range.
+
+    Args:
+        rev_range (str): Anything `git diff` accepts, e.g. `main...HEAD` or `HEAD~1`.
+            A single revision is compared with the working tree.
+        cwd (str): Any directory inside the repository.
+
+    Returns:
+        dict: Absolute file path mapped to a list of `(first_line, last_line)`
+        ranges, 1-based and inclusive, in the new version of the file.
+    """
+    root = _git(["rev-parse", "--show-toplevel"], cwd).strip()
+    # Explicit prefixes, a `diff.noprefix` setting would drop the `b/` of every path
+    diff = _git(["diff", "--unified=0", "--no-color", "--no-ext-diff", "--no-renames",
+                 "--src-prefix=a/", "--dst-prefix=b/", rev_range, "--"], root)
+
+    changes = {}
+    ranges = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            target = _target_path(line)
+            # Deleted files have nothing left to document
+            ranges = None if target is None else changes.setdefault(
+                os.path.normpath(os.path.join(root, target)), [])
+            continue
+
+        match = _HUNK_HEADER.match(line)
+        if match is None or ranges is None:
+            continue
+
+        start = int(match.group(1))
+        count = 1 if match.group(2) is None else int(match.group(2))
+        if count == 0:
+            # Pure deletion: the hunk sits after `start`, which is 0 at the top of the file
+            ranges.append((max(start, 1), max(start, 1)))
+        else:
+            ranges.append((start, start + count - 1))
+
+    logging.info("{} changed files in \'{}\'".format(len(changes), rev_range))
+    return changes
+
+
+def filter_changed(elements, ranges):
+    """Yields the elements whose lines overlap one of the changed ranges."""
+    for element in elements:
+        if any(first <= element['end_line'] and element['start_line'] <= last for first, last in ranges):
+            yield element
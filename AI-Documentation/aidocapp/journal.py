@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+def default_path(target: str) -> str:
+    # Named after the target, so concurrent runs on other files do not share one journal
+    digest = hashlib.sha256(os.path.abspath(target).encode()).hexdigest()[:16]
+    return ".aidocapp_journal.{}.jsonl".format(digest)
+
+
+class Journal:
+    """Append-only checkpoint of the comments finished during a run.
+
+    Every completed function is appended and flushed as one JSON line, so an
+    interrupted run loses at most the prompts that were still in flight. A
+    restarted run reuses the entries whose file and function source did not
+    change, and the journal is removed once a run finishes cleanly. Unlike the
+    cache it lives next to the client, so it also covers `--no_cache` and runs
+    against a model server.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry["comment"]
+                    except (ValueError, KeyError):
+                        # The last line may be incomplete if the previous run was killed mid-write
+                        continue
+        except OSError:
+            pass
+
+        if self._entries:
+            logging.info("Resuming with {} comments from \'{}\'".format(len(self._entries), path))
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(file_name: str, element) -> str:
+        digest = hashlib.sha256()
+        digest.update(os.path.abspath(file_name).encode() + b"\0")
+        digest.update(element['text'].encode())
+        return digest.hexdigest()
+
+    def get(self, file_name: str, element) -> "str | None":
+        return self._entries.get(self.key(file_name, element))
+
+    def record(self, file_name: str, element, comment: str):
+        line = json.dumps({"key": self.key(file_name, element), "comment": comment}) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, remove: bool = False):
+        with self._lock:
+            self._file.close()
+        if remove:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                # Removed by another run of the same target that finished first
+                pass
@@ -0,0 +1,76 @@
+import functools
+import importlib
+import importlib.util
+import os
+
+
+class LanguageSpec:
+    """Describes how to parse one language and which nodes are documented.
+
+    Args:
+        name (str): Language name used in prompts and cache keys.
+        module (str): Python package of the tree-sitter grammar, imported on first use.
+        extensions (tuple): File name suffixes of the language.
+        function_types (tuple): Node types that are sent to the model.
+        doc_style (str): Kind of documentation comment asked for in the prompt.
+        language_function (str): Function of `module` returning the grammar.
+        assigned_function_types (tuple): Function node types that are documented when they are the
+            value of a single variable declaration, e.g. `const f = (a) => a`.
+    """
+
+    def __init__(self, name, module, extensions, function_types, doc_style, language_function="language",
+                 assigned_function_types=()):
+        self.name = name
+        self.module = module
+        self.extensions = extensions
+        self.function_types = function_types
+        self.doc_style = doc_style
+        self.language_function = language_function
+        self.assigned_function_types = assigned_function_types
+
+    def is_available(self) -> bool:
+        # Looks the package up without importing it
+        return importlib.util.find_spec(self.module) is not None
+
+
+LANGUAGES = {
+    spec.name: spec for spec in (
+        LanguageSpec("python", "tree_sitter_python", (".py",),
+                     ("function_definition",), "docstring in the style of PEP 257"),
+        LanguageSpec("javascript", "tree_sitter_javascript", (".js", ".mjs", ".cjs", ".jsx"),
+                     ("function_declaration", "generator_function_declaration", "method_definition"),
+                     "JSDoc comment",
+                     assigned_function_types=("arrow_function", "function_expression", "generator_function")),
+        LanguageSpec("java", "tree_sitter_java", (".java",),
+                     ("method_declaration", "constructor_declaration"), "Javadoc comment"),
+        LanguageSpec("go", "tree_sitter_go", (".go",),
+                     ("function_declaration", "method_declaration"), "Go doc comment"),
+        LanguageSpec("c", "tree_sitter_c", (".c", ".h"),
+                     ("function_definition",), "Doxygen comment"),
+        LanguageSpec("cpp", "tree_sitter_cpp", (".cpp", ".cc", ".cxx", ".hpp", ".hh", ".hxx"),
+                     ("function_definition",), "Doxygen comment"),
+    )
+}
+
+_BY_EXTENSION = {extension: spec for spec in LANGUAGES.values() for extension in spec.extensions}
+
+
+def for_file(file_path: str) -> "LanguageSpec | None":
+    return _BY_EXTENSION.get(os.path.splitext(file_path)[1].lower())
+
+
+def extensions(names=None) -> tuple:
+    """Returns the file suffixes of the given languages, or of all languages with an installed grammar."""
+    specs = [LANGUAGES[name] for name in names] if names else [
+        spec for spec in LANGUAGES.values() if spec.is_available()]
+    return tuple(extension for spec in specs for extension in spec.extensions)
+
+
+@functools.lru_cache(maxsize=None)
+def get_language(name: str):
+    # Grammars are imported on first use only, so unused languages cost nothing
+    from tree_sitter import Language
+
+    spec = LANGUAGES[name]
+    module = importlib.import_module(spec.module)
+    return Language(getattr(module, spec.language_function)())
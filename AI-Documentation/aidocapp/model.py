@@ -1,17 +1,42 @@
 import llama_cpp
 import copy
+import re
+import time
+
+from aidocapp import cache, languages, planner, profiling
+
+# Lines of a doc comment put above the function by languages other than Python
+_COMMENT_PREFIXES = ("//", "/*", "*", "#")
+
+
+def _signature(code):
+    # The first line of a function that does not belong to the doc comment above it
+    for line in code.split("\n"):
+        line = line.strip()
+        if line and not line.startswith(_COMMENT_PREFIXES):
+            return line
+    return ""
 
 
 class Model:
     def __init__(
         self,
         local_model: "str | None" = None,
+        cache_dir: "str | None" = None,
+        stream: bool = False,
+        n_ctx: int = 4096,
+        answer_reserve: int = 512,
     ):
+        self.stream = stream
+        # Tokens kept free for the docstring and comments the model adds to a function
+        self.answer_reserve = answer_reserve
+        self._instruction_tokens = {}
         if local_model is not None:
             try:
                 self.llm = llama_cpp.Llama(
                     model_path=local_model,
                     n_gpu_layers=-1,
+                    n_ctx=n_ctx,
                     chat_format="llama-3",
                     verbose=False,
                 )
@@ -23,12 +48,193 @@ class Model:
             "content": "Add a detailed docstring in the style of PEP 257 to the following {} method {}. The docstring should include: - A concise summary of the method's purpose.- A detailed description of each argument (name and type). - A description of the return value (if any).  Add inline comments within the method body to explain complex logic or non-obvious steps. Return the method implementation with the docstring and inline comments as a single markdown code block. Do not modify the code. Do not add any chat-like comments."
         }]
 
+        # Instructions come first so consecutive batches share the same prompt prefix
+        self.batch_template = [{
+            "role": "user",
+            "content": "Add a detailed docstring in the style of PEP 257 to each of the following {} methods. Each docstring should include: - A concise summary of the method's purpose.- A detailed description of each argument (name and type). - A description of the return value (if any).  Add inline comments within the method bodies to explain complex logic or non-obvious steps. Return every method implementation with the docstring and inline comments as a separate markdown code block, in the same order as the methods are given. Do not modify the code. Do not add any chat-like comments.\n\n{}"
+        }]
+
+        # Used for functions too large to be returned in full, only the docstring is generated
+        self.summary_template = [{
+            "role": "user",
+            "content": "Write a detailed docstring in the style of PEP 257 for the following {} method. Some lines of its body are left out and marked with `...`. The docstring should include: - A concise summary of the method's purpose.- A detailed description of each argument (name and type). - A description of the return value (if any). Return only the docstring as a single markdown code block, without the method code. Do not add any chat-like comments.\n\n{}"
+        }]
+
+        self.cache = None
+        self.batch_cache = None
+        self.summary_cache = None
+        if cache_dir is not None:
+            model_id = cache.model_identity(local_model)
+            self.cache = cache.CommentCache(cache_dir, self.template, model_id)
+            self.batch_cache = cache.CommentCache(cache_dir, self.batch_template, model_id)
+            self.summary_cache = cache.CommentCache(cache_dir, self.summary_template, model_id)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode(), add_bos=False))
+
+    def _context_size(self) -> "int | None":
+        llm = getattr(self, "llm", None)
+        if llm is None or not hasattr(llm, "n_ctx") or not hasattr(llm, "tokenize"):
+            return None
+        return llm.n_ctx()
+
+    def _code_budget(self, template, language, repeated: bool) -> int:
+        # Tokens left for the function in a prompt built from the template. When the
+        # answer repeats the function, the function has to fit into the context twice.
+        key = (id(template), language)
+        if key not in self._instruction_tokens:
+            self._instruction_tokens[key] = self.count_tokens(
+                self._localized(template, language)[0]["content"].format(language, ""))
+        instructions = self._instruction_tokens[key]
+        available = self._context_size() - instructions - self.answer_reserve
+        return available // 2 if repeated else available
+
+    def _generate_docstring(self, code, language):
+        """Documents a function too large for the context from its summarized source.
+
+        Args:
+            code (str): Source code of the function.
+            language (str): Programming language of the function.
+
+        Returns:
+            str: The unchanged function with the generated docstring added.
+        """
+        if self.summary_cache is not None:
+            docstring = self.summary_cache.get(code, language)
+            if docstring is not None:
+                return planner.insert_docstring(code, docstring, language)
+
+        with profiling.stage("prompt_format"):
+            budget = self._code_budget(self.summary_template, language, False)
+            summary = planner.summarize(code, self.count_tokens, budget)
+            prompt_copy = self._localized(self.summary_template, language)
+            prompt_copy[0]["content"] = prompt_copy[0]["content"].format(
+                language, "```{}\n{}\n```".format(language, summary))
+
+        comment = self._complete(prompt_copy, "llm_summary")
+        blocks = re.findall(r"```[^\n]*\n(.*?)\n```", comment, re.DOTALL)
+        docstring = (blocks[0] if blocks else comment).strip("\n")
+        if language == "python" and not docstring.lstrip().lstrip("rRuU").startswith(('"""', "'''")):
+            docstring = '"""' + docstring.strip() + '\n"""'
+
+        if self.summary_cache is not None:
+            self.summary_cache.put(code, language, docstring)
+
+        return planner.insert_docstring(code, docstring, language)
+
+    @staticmethod
+    def _localized(template, language):
+        # The templates ask for PEP 257 docstrings, other languages get their own comment style
+        prompt_copy = copy.deepcopy(template)
+        spec = languages.LANGUAGES.get(language)
+        if spec is not None:
+            prompt_copy[0]["content"] = prompt_copy[0]["content"].replace(
+                languages.LANGUAGES["python"].doc_style, spec.doc_style)
+        return prompt_copy
+
+    def _complete_streamed(self, messages, stage: str) -> str:
+        # Tokens arrive as they are generated, which also gives the time to the first one
+        start_time = time.perf_counter()
+        first_token_time = None
+        parts = []
+        for chunk in self.llm.create_chat_completion(messages, stream=True):
+            content = chunk["choices"][0]["delta"].get("content")
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start_time
+                parts.append(content)
+
+        if profiling.enabled:
+            profiling.record(
+                stage,
+                time.perf_counter() - start_time,
+                tokens=len(parts),
+                ttft_s=first_token_time or 0.0,
+            )
+        return "".join(parts)
+
+    def _complete(self, messages, stage: str) -> str:
+        if self.stream:
+            return self._complete_streamed(messages, stage)
+
+        if not profiling.enabled:
+            return self.llm.create_chat_completion(messages)["choices"][0]["message"]["content"]
+
+        start_time = time.perf_counter()
+        response = self.llm.create_chat_completion(messages)
+        usage = response.get("usage") or {}
+        profiling.record(
+            stage,
+            time.perf_counter() - start_time,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            tokens=usage.get("completion_tokens", 0),
+        )
+        return response["choices"][0]["message"]["content"]
+
     def generate_comments(self, code, language):
+        if self.cache is not None:
+            code_comment = self.cache.get(code, language)
+            if code_comment is not None:
+                return code_comment
 
-        prompt_copy = copy.deepcopy(self.template)
-        prompt_copy[0]["content"] = prompt_copy[0]["content"].format(language, code)
+        if self._context_size() is not None:
+            with profiling.stage("plan"):
+                oversized = self.count_tokens(code) > self._code_budget(self.template, language, True)
+            if oversized:
+                return self._generate_docstring(code, language)
 
-        comment = self.llm.create_chat_completion(prompt_copy)["choices"][0]["message"]["content"]
+        with profiling.stage("prompt_format"):
+            prompt_copy = self._localized(self.template, language)
+            prompt_copy[0]["content"] = prompt_copy[0]["content"].format(language, code)
+
+        comment = self._complete(prompt_copy, "llm")
         code_comment = comment[comment.find('\n') + 1:comment.rfind('\n')]
 
+        if self.cache is not None:
+            self.cache.put(code, language, code_comment)
+
         return code_comment
+
+    def generate_comments_batch(self, codes, language):
+        """Documents several functions with a single chat completion.
+
+        Args:
+            codes (list): Source code of the functions to document.
+            language (str): Programming language of the functions.
+
+        Returns:
+            list: Documented code for every function, in the order of `codes`.
+        """
+        code_comments = [None] * len(codes)
+        missing = []
+        for index, code in enumerate(codes):
+            if self.batch_cache is not None:
+                code_comments[index] = self.batch_cache.get(code, language)
+            if code_comments[index] is None:
+                missing.append(index)
+
+        if len(missing) == 1:
+            code_comments[missing[0]] = self.generate_comments(code=codes[missing[0]], language=language)
+        elif missing:
+            with profiling.stage("prompt_format"):
+                prompt_copy = self._localized(self.batch_template, language)
+                prompt_copy[0]["content"] = prompt_copy[0]["content"].format(
+                    language, "\n\n".join("```{}\n{}\n```".format(language, codes[index]) for index in missing))
+
+            comment = self._complete(prompt_copy, "llm_batch")
+            blocks = re.findall(r"```[^\n]*\n(.*?)\n```", comment, re.DOTALL)
+
+            # Every block has to start with the signature of its function, after the doc comment of
+            # other languages, otherwise the answer cannot be mapped back and the functions are sent one by one
+            if len(blocks) == len(missing) and all(
+                    _signature(block) == codes[index].partition("\n")[0].strip()
+                    for block, index in zip(blocks, missing)):
+                for block, index in zip(blocks, missing):
+                    code_comments[index] = block
+                    if self.batch_cache is not None:
+                        self.batch_cache.put(codes[index], language, block)
+            else:
+                for index in missing:
+                    code_comments[index] = self.generate_comments(code=codes[index], language=language)
+
+        return code_comments
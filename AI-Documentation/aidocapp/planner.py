@@ -0,0 +1,100 @@
+import re
+
+# Lines that tell the most about what a function produces or how it fails
+_KEY_LINE = re.compile(r"^\s*(return|yield|raise|throw)\b")
+
+ELLIPSIS = "..."
+
+
+def summarize(code: str, count_tokens, budget: int) -> str:
+    """Shrinks a function to its signature and the lines that fit into a token budget.
+
+    The first line is always kept, then `return`/`raise`-like lines, then the
+    body from the top. Every run of left out lines is replaced by an indented
+    `...` line, so the model knows that the body is incomplete.
+
+    Args:
+        code (str): Source code of the function.
+        count_tokens: Callable returning the number of tokens of a string.
+        budget (int): Maximum number of tokens of the summary.
+
+    Returns:
+        str: The summarized function.
+    """
+    lines = code.split("\n")
+    costs = [count_tokens(line) + 1 for line in lines]
+
+    kept = {0}
+    used = costs[0]
+    key_lines = [index for index in range(1, len(lines)) if _KEY_LINE.match(lines[index])]
+    key_set = set(key_lines)
+    order = key_lines + [index for index in range(1, len(lines)) if index not in key_set]
+    for index in order:
+        if used + costs[index] > budget:
+            continue
+        kept.add(index)
+        used += costs[index]
+
+    summary = []
+    for index, line in enumerate(lines):
+        if index in kept:
+            summary.append(line)
+        elif summary and summary[-1].strip() != ELLIPSIS:
+            indentation = re.match(r"\s*", line).group(0)
+            summary.append(indentation + ELLIPSIS)
+    return "\n".join(summary)
+
+
+def _docstring_line(code: str, language: str) -> int:
+    if language == "python":
+        from aidocapp import utils
+
+        tree = utils.get_parser("python").parse(code.encode())
+        node = tree.root_node.named_children[0] if tree.root_node.named_child_count else None
+        body = node.child_by_field_name("body") if node is not None else None
+        if body is not None and body.start_point[0] > 0:
+            return body.start_point[0]
+    return 1
+
+
+def _function_indentation(lines, index: int, language: str) -> str:
+    # The indentation of the function in its file, which every line after the first carries
+    if len(lines) < 2:
+        return ""
+    if language != "python":
+        # The closing brace is at the indentation of the function
+        return re.match(r"\s*", lines[-1]).group(0)
+
+    body = re.match(r"\s*", lines[index]).group(0) if index < len(lines) else ""
+    if body.startswith("\t"):
+        return body[:-1]
+    # One level of indentation, from the blocks nested in the body or the usual widths
+    depths = [len(line) - len(line.lstrip()) for line in lines[index:] if line.strip()]
+    steps = [inner - outer for outer, inner in zip(depths, depths[1:]) if inner > outer]
+    step = min(steps) if steps else next((width for width in (4, 2) if len(body) % width == 0), len(body))
+    return body[:max(len(body) - step, 0)]
+
+
+def insert_docstring(code: str, docstring: str, language: str) -> str:
+    """Adds a generated docstring to the unchanged source of a function.
+
+    Python docstrings go in front of the first body statement, with its
+    indentation. For other languages the comment is put above the function.
+    Like the code written by the model, the lines after the first are
+    relative to the function, the writer indents them to its place in the file.
+    """
+    docstring_lines = docstring.strip("\n").split("\n")
+    lines = code.split("\n")
+    index = _docstring_line(code, language)
+
+    indentation = _function_indentation(lines, index, language)
+    lines = lines[:1] + [line[len(indentation):] if line.startswith(indentation) else line
+                         for line in lines[1:]]
+
+    if language != "python":
+        return "\n".join(docstring_lines + lines)
+
+    indentation = re.match(r"\s*", lines[index]).group(0) if index < len(lines) else "    "
+    common = min((len(line) - len(line.lstrip()) for line in docstring_lines if line.strip()), default=0)
+    docstring_lines = [indentation + line[common:] if line.strip() else "" for line in docstring_lines]
+    return "\n".join(lines[:index] + docstring_lines + lines[index:])
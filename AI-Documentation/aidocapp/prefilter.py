@@ -0,0 +1,67 @@
+import logging
+import re
+
+# Document every function, even the ones that already have a docstring
+POLICY_ALL = "all"
+# Skip every function that already has a docstring
+POLICY_MISSING = "missing"
+# Skip functions whose docstring already describes all arguments and the return value
+POLICY_INCOMPLETE = "incomplete"
+
+POLICIES = (POLICY_ALL, POLICY_MISSING, POLICY_INCOMPLETE)
+
+# Returns sections of Google/NumPy style, reST fields, JSDoc/Javadoc tags and Doxygen commands
+_RETURNS_SECTION = re.compile(
+    r"^[\s*/#]*(returns?|yields?)\b|:returns?:|:rtype:|[@\\]returns?\b", re.IGNORECASE | re.MULTILINE)
+_IMPLICIT_PARAMETERS = ("self", "cls", "this")
+
+
+def is_trivial(element) -> bool:
+    """A function whose body is a single statement that fits on its signature's line or the next one."""
+    return element['statements'] <= 1 and element['text'].strip().count('\n') <= 1
+
+
+def is_docstring_complete(element) -> bool:
+    docstring = element['docstring']
+    if docstring is None:
+        return False
+
+    for parameter in element['parameters']:
+        if parameter in _IMPLICIT_PARAMETERS:
+            continue
+        if not re.search(r"\b{}\b".format(re.escape(parameter)), docstring):
+            return False
+
+    return not element['returns_value'] or bool(_RETURNS_SECTION.search(docstring))
+
+
+def skip_reason(element, policy: str = POLICY_MISSING, skip_trivial: bool = True) -> "str | None":
+    """Returns why an element does not need a prompt, or None if it should be documented."""
+    if element['type'] != 'function_definition' or not element['text'].strip():
+        return "empty element"
+    if skip_trivial and is_trivial(element):
+        return "trivial function"
+    if policy == POLICY_MISSING and element['docstring'] is not None:
+        return "already documented"
+    if policy == POLICY_INCOMPLETE and is_docstring_complete(element):
+        return "docstring already complete"
+    return None
+
+
+def filter_elements(elements, policy: str = POLICY_MISSING, skip_trivial: bool = True):
+    """Yields the elements that still need documentation.
+
+    Args:
+        elements: Elements returned by `utils.extract_elements`.
+        policy (str): One of `POLICIES`, decides how existing docstrings are treated.
+        skip_trivial (bool): Skip functions with a single statement on at most two lines.
+
+    Yields:
+        dict: Elements that should be sent to the model.
+    """
+    for element in elements:
+        reason = skip_reason(element, policy, skip_trivial)
+        if reason is None:
+            yield element
+        else:
+            logging.info("Skipping \'{}\' method: {}".format(element['text'].partition('\n')[0], reason))
@@ -0,0 +1,66 @@
+import contextlib
+import json
+import threading
+import time
+
+_lock = threading.Lock()
+_stages = {}
+enabled = False
+
+
+def enable(value: bool = True):
+    global enabled
+    enabled = value
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def record(name: str, seconds: float, **counters):
+    """Adds one measurement of a stage, with optional counters such as produced tokens."""
+    with _lock:
+        stats = _stages.setdefault(name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["count"] += 1
+        stats["total_s"] += seconds
+        stats["max_s"] = max(stats["max_s"], seconds)
+        for counter, value in counters.items():
+            stats[counter] = stats.get(counter, 0) + value
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Times the wrapped block as one call of a pipeline stage, a no-op unless profiling is enabled."""
+    if not enabled:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+def report() -> dict:
+    """Returns the collected stages with derived means and token rates.
+
+    Only stages of the current process are included, so parsing done by a
+    process pool (`--workers` > 1) is not part of the report.
+    """
+    with _lock:
+        stages = {name: dict(stats) for name, stats in _stages.items()}
+
+    for stats in stages.values():
+        stats["mean_ms"] = 1000 * stats["total_s"] / stats["count"]
+        if "tokens" in stats and stats["total_s"] > 0:
+            stats["tokens_per_s"] = stats["tokens"] / stats["total_s"]
+        if "ttft_s" in stats:
+            stats["mean_ttft_ms"] = 1000 * stats["ttft_s"] / stats["count"]
+    return stages
+
+
+def dump(path: str, **extra):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(dict(extra, stages=report()), file, indent=2, sort_keys=True)
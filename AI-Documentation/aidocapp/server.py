@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aidocapp import engine
+
+DEFAULT_ADDRESS = "http://127.0.0.1:8765"
+
+
+class RemoteModel:
+    """Thin client with the interface of `model.Model` that forwards prompts to a running server."""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 600.0):
+        self.address = address.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, endpoint: str, payload: dict):
+        request = urllib.request.Request(
+            self.address + endpoint,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def is_alive(self) -> bool:
+        try:
+            with urllib.request.urlopen(self.address + "/health", timeout=5) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+    def generate_comments(self, code, language):
+        return self._post("/generate", {"code": code, "language": language})["comment"]
+
+    def generate_comments_batch(self, codes, language):
+        return self._post("/generate_batch", {"codes": codes, "language": language})["comments"]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set on the class by `serve`
+    model_pool: engine.ModelPool = None
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "model_instances": self.model_pool.size})
+        else:
+            self._reply(404, {"error": "unknown endpoint"})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if self.path == "/generate":
+                comment = self.model_pool.generate_comments(request["code"], request["language"])
+                self._reply(200, {"comment": comment})
+            elif self.path == "/generate_batch":
+                comments = self.model_pool.generate_comments_batch(request["codes"], request["language"])
+                self._reply(200, {"comments": comments})
+            else:
+                self._reply(404, {"error": "unknown endpoint"})
+        except (ValueError, KeyError) as e:
+            self._reply(400, {"error": "invalid request: {}".format(e)})
+        except Exception as e:
+            logging.exception("Generation failed")
+            self._reply(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def serve(model_pool: engine.ModelPool, host: str = "127.0.0.1", port: int = 8765):
+    """Serves prompts from resident model instances until interrupted.
+
+    Args:
+        model_pool (engine.ModelPool): Loaded model instances shared by all requests.
+        host (str): Interface to listen on, keep it on localhost.
+        port (int): TCP port to listen on.
+    """
+    handler = type("Handler", (_Handler,), {"model_pool": model_pool})
+    with ThreadingHTTPServer((host, port), handler) as http_server:
+        logging.info("Serving {} model instance(s) on http://{}:{}".format(model_pool.size, host, port))
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Keeps the model loaded and serves aidocapp clients.")
+    parser.add_argument(
+        "--local_model",
+        type=str,
+        required=True,
+        help="Path to the local model.",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Interface to listen on.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--model_instances",
+        type=int,
+        default=1,
+        help="Number of model instances generating comments concurrently.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=".aidocapp_cache",
+        help="Directory of the cache with previously generated comments.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Always generate comments, without reading or updating the cache.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from aidocapp import model
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    model_pool = engine.ModelPool(
+        [model.Model(local_model=args.local_model, cache_dir=cache_dir) for _ in range(max(args.model_instances, 1))]
+    )
+    serve(model_pool, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,31 +1,266 @@
-def extract_elements(node, source_code):
-    elements = []
-    if node.type == 'function_definition':
-        elements.append({
-            'type': 'function_definition',
-            'text': source_code[node.start_byte:node.end_byte].decode('utf8')
-        })
-    for child in node.children:
-        elements.extend(extract_elements(child, source_code))
-    return elements
+import functools
+import logging
+import os
+import shutil
+import tempfile
 
+from tree_sitter import Parser
 
-def write_code_comments_to_file(file_path: str, original_code: str, modified_code: str):
-    with open(file_path, "r", encoding="utf-8") as file:
-        file_content = file.read()
-        start_pos = file_content.find(original_code)
+from aidocapp import languages, profiling
 
-        if start_pos != -1:
-            end_pos = start_pos + len(original_code)
-            indentation = file_content[:start_pos].split("\n")[-1]
+# Nodes with return statements of their own, in any of the registered languages
+_NESTED_SCOPES = {
+    'function_definition', 'lambda', 'class_definition', 'function_declaration', 'function_expression',
+    'generator_function_declaration', 'arrow_function', 'method_definition', 'class_declaration',
+    'method_declaration', 'lambda_expression', 'func_literal',
+}
+# Nodes that wrap a function, its documentation comment sits before the wrapper
+_WRAPPERS = {'export_statement', 'template_declaration', 'decorated_definition'}
+_COMMENTS = {'comment', 'line_comment', 'block_comment'}
+# Declarations whose single declarator may hold a function, e.g. `const f = (a) => a`
+_DECLARATIONS = {'lexical_declaration', 'variable_declaration'}
 
-            modeified_lines = modified_code.split("\n")
-            first_line = modeified_lines.pop(0)
 
-            indented_modified_lines = [indentation + line for line in modeified_lines]
-            indented_modified_code = (first_line + "\n" + "\n".join(indented_modified_lines))
+@functools.lru_cache(maxsize=None)
+def get_parser(language: str = "python") -> Parser:
+    # Building the language and parser is done once per process and reused for every file
+    return Parser(languages.get_language(language))
 
-            modified_content = (file_content[:start_pos] + indented_modified_code + file_content[end_pos:])
 
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(modified_content)
+def parse_file(file_path: str):
+    spec = languages.for_file(file_path) or languages.LANGUAGES["python"]
+
+    with profiling.stage("read"), open(file_path, "r", encoding="utf-8") as file:
+        # Read the entire content of the file into a string
+        file_bytes = file.read().encode()
+
+    with profiling.stage("parse"):
+        tree = get_parser(spec.name).parse(file_bytes)
+
+    with profiling.stage("extract"):
+        return file_path, extract_elements(tree.root_node, file_bytes, spec)
+
+
+def iter_elements(node, source_code, spec: "languages.LanguageSpec | None" = None):
+    """Yields function definitions below a node in source order.
+
+    The tree is walked with a tree-sitter cursor instead of recursion, so deep
+    ASTs do not grow the Python stack and no intermediate lists are built.
+    Methods of nested classes and nested functions are included. The node
+    types that count as functions come from the language spec, Python by default.
+    """
+    spec = spec or languages.LANGUAGES["python"]
+    cursor = node.walk()
+    visited_children = False
+
+    while True:
+        if not visited_children:
+            current = cursor.node
+            function = current if current.type in spec.function_types else _assigned_function(current, spec)
+            if function is not None:
+                element = {
+                    'type': 'function_definition',
+                    'language': spec.name,
+                    'text': source_code[current.start_byte:current.end_byte].decode('utf8'),
+                    'start_byte': current.start_byte,
+                    'end_byte': current.end_byte,
+                    'splice_byte': _splice_byte(current, spec.name),
+                    'start_line': current.start_point[0] + 1,
+                    'end_line': current.end_point[0] + 1,
+                }
+                element.update(_function_info(function, source_code, spec.name, current))
+                yield element
+            if cursor.goto_first_child():
+                continue
+
+        if cursor.goto_next_sibling():
+            visited_children = False
+        elif cursor.goto_parent():
+            visited_children = True
+        else:
+            return
+
+
+def _assigned_function(node, spec):
+    # The function of `const f = ...`, the declaration is documented as a whole
+    if not spec.assigned_function_types or node.type not in _DECLARATIONS or node.named_child_count != 1:
+        return None
+    value = node.named_children[0].child_by_field_name('value')
+    if value is None or value.type not in spec.assigned_function_types:
+        return None
+    return value
+
+
+def _splice_byte(node, language: str = "python"):
+    # Doc comments of other languages go in front of `export`, `template<...>` and the like.
+    # Python docstrings go into the body, so decorators stay where they are.
+    if language != "python":
+        while node.parent is not None and node.parent.type in _WRAPPERS:
+            node = node.parent
+    return node.start_byte
+
+
+def _parameters_node(node):
+    # C and C++ keep the parameters in a function declarator nested in the declarator chain
+    while node is not None:
+        parameters = node.child_by_field_name('parameters')
+        if parameters is not None:
+            return parameters
+        node = node.child_by_field_name('declarator')
+    return None
+
+
+def _doc_comment(node, source_code):
+    while node.parent is not None and node.parent.type in _WRAPPERS:
+        node = node.parent
+
+    comments = []
+    sibling = node.prev_sibling
+    # Only comments directly above the function, without a blank line in between
+    while sibling is not None and sibling.type in _COMMENTS \
+            and (comments[0] if comments else node).start_point[0] - sibling.end_point[0] <= 1:
+        comments.insert(0, sibling)
+        sibling = sibling.prev_sibling
+
+    if not comments:
+        return None
+    return source_code[comments[0].start_byte:comments[-1].end_byte].decode('utf8')
+
+
+def _function_info(node, source_code, language: str = "python", documented_node=None):
+    # Facts used by the prefilter, computed here so they travel with the element.
+    # documented_node is the declaration of an assigned function, its comment sits above it.
+    body = node.child_by_field_name('body')
+    if body is not None and body.type not in ('block', 'statement_block', 'compound_statement'):
+        # Expression body of an arrow function
+        statements = [body]
+    else:
+        statements = [child for child in body.named_children if child.type not in _COMMENTS] if body else []
+
+    docstring = None
+    if language != "python":
+        docstring = _doc_comment(documented_node or node, source_code)
+    elif statements and statements[0].type == 'expression_statement' \
+            and statements[0].named_child_count == 1 and statements[0].named_children[0].type == 'string':
+        docstring = source_code[statements[0].start_byte:statements[0].end_byte].decode('utf8')
+
+    parameters = []
+    parameters_node = _parameters_node(node)
+    for parameter in parameters_node.named_children if parameters_node else []:
+        # Typed, default and splat parameters keep their identifier as the first named child
+        name_node = parameter
+        while name_node is not None and name_node.type != 'identifier':
+            name_node = name_node.child_by_field_name('name') or name_node.child_by_field_name('declarator') or (
+                name_node.named_children[0] if name_node.named_child_count else None)
+        if name_node is not None:
+            parameters.append(source_code[name_node.start_byte:name_node.end_byte].decode('utf8'))
+
+    return {
+        'docstring': docstring,
+        'parameters': parameters,
+        'statements': len(statements),
+        'returns_value': any(_returns_value(statement) for statement in statements),
+    }
+
+
+def _returns_value(node):
+    # Nested functions, lambdas and classes have returns of their own
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current.type == 'return_statement' and current.named_child_count > 0:
+            return True
+        if current.type == 'yield':
+            return True
+        stack.extend(child for child in current.named_children if child.type not in _NESTED_SCOPES)
+    return False
+
+
+def extract_elements(node, source_code, spec: "languages.LanguageSpec | None" = None):
+    return list(iter_elements(node, source_code, spec))
+
+
+def _indent_modified_code(modified_code: str, indentation: bytes) -> bytes:
+    modified_lines = modified_code.encode().split(b"\n")
+    first_line = modified_lines.pop(0)
+
+    indented_modified_lines = [indentation + line if line else line for line in modified_lines]
+    return first_line + b"\n" + b"\n".join(indented_modified_lines)
+
+
+def write_code_comments_to_file(file_path: str, edits):
+    """Splices documented code into a file in a single pass.
+
+    Args:
+        file_path (str): Path of the file the elements were extracted from.
+        edits: Pairs of an element returned by `extract_elements` and the
+            documented code that replaces it.
+
+    Returns:
+        int: Number of elements that were replaced.
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            file_bytes = file.read().encode()
+    except (OSError, UnicodeDecodeError) as error:
+        logging.warning("Skipping \'{}\' file: {}".format(file_path, error))
+        return 0
+
+    # Apply edits from the end of the file, so the offsets of the remaining ones stay valid.
+    # A nested function is skipped when its enclosing function is rewritten as well.
+    outer_edits = []
+    for element, modified_code in sorted(edits, key=lambda edit: (edit[0]['start_byte'], -edit[0]['end_byte'])):
+        if outer_edits and element['start_byte'] < outer_edits[-1][0]['end_byte']:
+            continue
+        outer_edits.append((element, modified_code))
+
+    chunks = []
+    end_pos = len(file_bytes)
+    applied = 0
+    for element, modified_code in reversed(outer_edits):
+        start_byte, end_byte = element['start_byte'], element['end_byte']
+
+        if file_bytes[start_byte:end_byte] != element['text'].encode():
+            logging.warning("Skipping stale element in \'{}\' at byte {}".format(file_path, start_byte))
+            continue
+
+        # Wrappers like `export ` or `template<...> ` come first on the line, the doc comment goes above them
+        splice_byte = element.get('splice_byte', start_byte)
+        line_start = file_bytes.rfind(b"\n", 0, splice_byte) + 1
+        line_prefix = file_bytes[line_start:splice_byte]
+        indentation = line_prefix[:len(line_prefix) - len(line_prefix.lstrip())]
+
+        wrapper_prefix = file_bytes[splice_byte:start_byte].decode('utf8')
+        if wrapper_prefix:
+            # Lines of a multi-line wrapper get their indentation back from `_indent_modified_code`
+            prefix_lines = wrapper_prefix.split('\n')
+            wrapper_prefix = '\n'.join(prefix_lines[:1] + [
+                line[len(indentation):] if line.startswith(indentation.decode('utf8')) else line
+                for line in prefix_lines[1:]])
+            signature = element['text'].partition('\n')[0]
+            position = max(modified_code.find(signature), 0)
+            modified_code = modified_code[:position] + wrapper_prefix + modified_code[position:]
+
+        chunks.append(file_bytes[end_byte:end_pos])
+        chunks.append(_indent_modified_code(modified_code, indentation))
+        end_pos = splice_byte
+        applied += 1
+
+    if applied == 0:
+        return 0
+
+    chunks.append(file_bytes[:end_pos])
+    modified_content = b"".join(reversed(chunks))
+
+    # Write to a temporary file next to the original and swap it in atomically
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(modified_content.decode("utf-8"))
+        shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return applied
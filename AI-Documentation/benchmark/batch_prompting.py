@@ -0,0 +1,55 @@
+import argparse
+import glob
+import os
+import time
+
+from aidocapp import model, utils
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Compares one prompt per function with batched prompting.")
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=os.path.join(os.path.dirname(__file__), "..", "example"),
+        help="Directory with the python files used for the benchmark.",
+    )
+    parser.add_argument(
+        "--local_model",
+        type=str,
+        required=True,
+        help="Path to the local model.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=4,
+        help="Number of functions packed into one prompt.",
+    )
+    args = parser.parse_args()
+
+    codes = []
+    for file_name in sorted(glob.glob(os.path.join(args.path, "*.py"))):
+        _, elements = utils.parse_file(file_name)
+        codes.extend(element['text'] for element in elements)
+
+    model_wrapper = model.Model(local_model=args.local_model)
+
+    start_time = time.perf_counter()
+    for code in codes:
+        model_wrapper.generate_comments(code=code, language="python")
+    single_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for index in range(0, len(codes), args.batch_size):
+        model_wrapper.generate_comments_batch(codes=codes[index:index + args.batch_size], language="python")
+    batch_time = time.perf_counter() - start_time
+
+    print("Functions:             {}".format(len(codes)))
+    print("One call per function: {:.2f}s ({:.2f} functions/s)".format(single_time, len(codes) / single_time))
+    print("Batch of {}:            {:.2f}s ({:.2f} functions/s)".format(
+        args.batch_size, batch_time, len(codes) / batch_time))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmark import synthetic
+
+synthetic.install_stub()
+
+from aidocapp import engine, model, prefilter, profiling  # noqa: E402
+
+
+def _compare(report, baseline_path: str, tolerance: float):
+    # Only the non-LLM stages are compared, their cost does not depend on the hardware running the model
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)["stages"]
+
+    regressions = []
+    for name, stats in report.items():
+        if name.startswith("llm") or name == "total" or name not in baseline:
+            continue
+        if stats["mean_ms"] > baseline[name]["mean_ms"] * (1 + tolerance):
+            regressions.append("{}: {:.3f}ms per call, baseline {:.3f}ms".format(
+                name, stats["mean_ms"], baseline[name]["mean_ms"]))
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Profiles the aidocapp pipeline on a synthetic corpus with a stub model.")
+    parser.add_argument("--files", type=int, default=50, help="Number of generated files.")
+    parser.add_argument("--functions", type=int, default=20, help="Functions per generated file.")
+    parser.add_argument("--statements", type=int, default=8, help="Maximum number of statements per function.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator.")
+    parser.add_argument("--model_instances", type=int, default=1, help="Number of stub model instances.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Functions packed into one prompt.")
+    parser.add_argument("--stream", action="store_true", help="Stream completions token by token.")
+    parser.add_argument("--local_model", type=str, help="Profile a real model instead of the stub.")
+    parser.add_argument("--output", type=str, default="benchmark_report.json", help="Path of the JSON report.")
+    parser.add_argument("--baseline", type=str, help="Earlier JSON report to compare the non-LLM stages with.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative slowdown per stage compared with the baseline.",
+    )
+    args = parser.parse_args()
+
+    profiling.enable()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_list = synthetic.generate_corpus(directory, args.files, args.functions, args.statements, args.seed)
+
+        models = []
+        for _ in range(max(args.model_instances, 1)):
+            model_wrapper = model.Model(local_model=args.local_model, stream=args.stream)
+            if args.local_model is None:
+                model_wrapper.llm = synthetic.StubLlama()
+            models.append(model_wrapper)
+
+        start_time = time.perf_counter()
+        functions_count = engine.document_files(
+            file_list,
+            engine.ModelPool(models),
+            batch_size=args.batch_size,
+            policy=prefilter.POLICY_ALL,
+            skip_trivial=False,
+        )
+        wall_time = time.perf_counter() - start_time
+
+    profiling.dump(
+        args.output,
+        corpus=vars(args),
+        functions=functions_count,
+        wall_s=wall_time,
+        stub=args.local_model is None,
+    )
+
+    for name, stats in sorted(profiling.report().items()):
+        print("{:<15} {:>7} calls {:>10.3f}s total {:>9.3f}ms mean".format(
+            name, stats["count"], stats["total_s"], stats["mean_ms"]))
+    print("Report written to {}".format(os.path.abspath(args.output)))
+
+    if args.baseline is not None:
+        regressions = _compare(profiling.report(), args.baseline, args.tolerance)
+        if regressions:
+            sys.exit("Slower than the baseline:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,112 @@
+import os
+import random
+import re
+import sys
+import types
+
+
+class StubLlama:
+    """Deterministic stand-in for `llama_cpp.Llama` that answers instantly.
+
+    Every function found in the prompt is returned with a docstring added
+    after its signature, in the same markdown format as the real model, so
+    the rest of the pipeline runs unchanged.
+    """
+
+    def __init__(self, *args, n_ctx: int = 4096, **kwargs):
+        self.calls = 0
+        self._n_ctx = n_ctx
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        # One token per whitespace separated word is close enough for planning
+        return text.split()
+
+    @staticmethod
+    def _functions(content):
+        blocks = re.findall(r"```[^\n]*\n(.*?)\n```", content, re.DOTALL)
+        if blocks:
+            return blocks
+        # The single function template embeds the code without a fence
+        match = re.search(r" method (.*?)\. The docstring should include", content, re.DOTALL)
+        return [match.group(1)] if match else []
+
+    @staticmethod
+    def _document(code):
+        signature, _, body = code.partition("\n")
+        indentation = re.match(r"\s*", body).group(0) or "    "
+        return '{}\n{}"""Generated docstring."""\n{}'.format(signature, indentation, body)
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        content = messages[-1]["content"]
+        if "Return only the docstring" in content:
+            answer = '```python\n"""Generated docstring."""\n```'
+        else:
+            answer = "\n".join("```python\n{}\n```".format(self._document(code)) for code in self._functions(content))
+        if stream:
+            return ({"choices": [{"delta": {"content": token}}]} for token in re.split(r"(?<=\s)", answer))
+        return {
+            "choices": [{"message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": len(content.split()), "completion_tokens": len(answer.split())},
+        }
+
+
+def install_stub():
+    """Makes `import llama_cpp` resolve to the stub when the real package is missing."""
+    try:
+        import llama_cpp  # noqa: F401
+    except ImportError:
+        sys.modules["llama_cpp"] = types.SimpleNamespace(Llama=StubLlama)
+
+
+def _function(rng, name, statements):
+    lines = ["def {}(a, b, c=None):".format(name)]
+    for index in range(statements):
+        kind = rng.randrange(3)
+        if kind == 0:
+            lines.append("    x{} = a * {} + b".format(index, rng.randrange(100)))
+        elif kind == 1:
+            lines.append("    if c is not None and c > {}:".format(rng.randrange(100)))
+            lines.append("        a = a - c")
+        else:
+            lines.append("    for i in range({}):".format(rng.randrange(1, 10)))
+            lines.append("        b += i")
+    lines.append("    return a + b")
+    return "\n".join(lines)
+
+
+def generate_corpus(directory: str, files: int = 50, functions: int = 20, statements: int = 8, seed: int = 0):
+    """Writes a reproducible set of python files with undocumented functions.
+
+    Args:
+        directory (str): Directory the files are created in.
+        files (int): Number of files.
+        functions (int): Functions per file, every fourth one is a method of a class.
+        statements (int): Upper bound of statements per function body.
+        seed (int): Seed of the generator, the same seed gives the same corpus.
+
+    Returns:
+        list: Paths of the generated files.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for file_index in range(files):
+        chunks = []
+        for function_index in range(functions):
+            code = _function(rng, "f_{}_{}".format(file_index, function_index), rng.randrange(2, statements + 1))
+            if function_index % 4 == 3:
+                code = "class C{}:\n".format(function_index) + "\n".join(
+                    "    " + line if line else line for line in code.replace("(a,", "(self, a,", 1).split("\n"))
+            chunks.append(code)
+
+        path = os.path.join(directory, "module_{:04d}.py".format(file_index))
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n\n\n".join(chunks) + "\n")
+        paths.append(path)
+
+    return paths
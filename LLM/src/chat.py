@@ -1,186 +1,641 @@
-import torch
-from transformers import AutoTokenizer, GenerationConfig, TextIteratorStreamer
-from ipex_llm.transformers import AutoModelForCausalLM
-import streamlit as st
-import threading
-import os
-
-os.environ["SYCL_CACHE_PERSISTENT"] = "1"
-os.environ["BIGDL_LLM_XMX_DISABLED"] = "1"
-
-MODEL_CACHE = {}
-
-
-def save_model_thread(model, model_path):
-    """
-    Save the model to the specified path in a separate thread.
-
-    Args:
-        model: The model to be saved.
-        model_path (str): The path where the model will be saved.
-    """
-    model.save_low_bit(model_path)
-    print(f"Model saved to {model_path}")
-
-
-def warmup_model(model, tokenizer):
-    """
-    Warm up the model by generating a dummy response.
-
-    Args:
-        model: The model to be warmed up.
-        tokenizer: The tokenizer associated with the model.
-    """
-    question = "Hello, how are you?"
-    tokenizer.pad_token = tokenizer.eos_token
-    if model.name_or_path.startswith("microsoft"):
-        prompt = f"<|user|>\n{question}<|end|>\n<|assistant|>"
-    else:
-        prompt = "user: {prompt}\n\nassistant:".format(prompt=question)
-    dummy_input = tokenizer(prompt, return_tensors="pt").to("xpu")
-    generation_config = GenerationConfig(use_cache=True,
-                                         top_k=50,
-                                         top_p=0.95,
-                                         temperature=0.7, do_sample=True,
-                                         )
-    _ = model.generate(**dummy_input, generation_config=generation_config)
-    print("Model warmed up successfully!")
-
-
-def load_model(model_name: str = "Qwen/Qwen-1_8B-Chat"):
-    """
-    Load the specified model and tokenizer.
-
-    Args:
-        model_name (str): The name of the model to be loaded.
-
-    Returns:
-        tuple: The loaded model and tokenizer.
-    """
-    if model_name in MODEL_CACHE:
-        return MODEL_CACHE[model_name]
-
-    tokenizer = AutoTokenizer.from_pretrained(
-        model_name, trust_remote_code=True)
-    model_path = f"./model_local_cache/{model_name}"
-
-    try:
-        if os.path.exists(model_path):
-            print(f"Loading model from {model_path}")
-            model = AutoModelForCausalLM.load_low_bit(
-                model_path, cpu_embedding=True, trust_remote_code=True
-            )
-        else:
-            print(f"Loading model from {model_name}")
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                load_in_4bit=True,
-                cpu_embedding=True,
-                trust_remote_code=True
-            )
-            save_model_thread(model, model_path)
-
-        model = model.to("xpu")
-
-        MODEL_CACHE[model_name] = (model, tokenizer)
-        print("Model loaded successfully!")
-        return model, tokenizer
-    except Exception as e:
-        print(f"Failed to load model: {e}")
-        return None, None
-
-
-def get_response(model, tokenizer, input_text: str):
-    """
-    Generate a response from the model based on the input text.
-
-    Args:
-        model: The model to generate the response.
-        tokenizer: The tokenizer associated with the model.
-        input_text (str): The input text for the model.
-
-    Returns:
-        TextIteratorStreamer: The streamer for the generated response.
-    """
-    question = input_text
-    tokenizer.pad_token = tokenizer.eos_token
-    if model.name_or_path.startswith("microsoft"):
-        prompt = f"<|user|>\n{question}<|end|>\n<|assistant|>"
-    else:
-        prompt = "user: {prompt}\n\nassistant:".format(prompt=question)
-
-    with torch.inference_mode():
-        input_ids = tokenizer(prompt, return_tensors="pt").to("xpu")
-        streamer = TextIteratorStreamer(
-            tokenizer, skip_prompt=False, skip_special_tokens=True
-        )
-
-        generation_config = GenerationConfig(
-            use_cache=True, top_k=50, top_p=0.95,
-            temperature=0.7, do_sample=True,
-        )
-
-        kwargs = dict(
-            input_ids,
-            streamer=streamer,
-            max_new_tokens=256,
-            generation_config=generation_config,
-        )
-        thread = threading.Thread(target=model.generate, kwargs=kwargs)
-        thread.start()
-    return streamer
-
-
-def main():
-    """
-    Main function to run the Streamlit app.
-    """
-    try:
-        if "model" not in st.session_state:
-            st.session_state.model = None
-        if "tokenizer" not in st.session_state:
-            st.session_state.tokenizer = None
-
-        st.header("Lets chat... 🐻‍❄️")
-        selected_model = st.selectbox(
-            "Please select a model",
-            ("Qwen/Qwen-1_8B-Chat",
-             "microsoft/Phi-3-mini-4k-instruct"))
-
-        if st.button("Load Model"):
-            with st.spinner("Loading..."):
-                st.session_state.model, st.session_state.tokenizer = load_model(
-                    model_name=selected_model)
-                if (
-                    st.session_state.model is not None
-                    and st.session_state.tokenizer is not None
-                ):
-                    st.success("Model loaded successfully!")
-                    st.info("Warming up the model...")
-                    warmup_model(
-                        st.session_state.model,
-                        st.session_state.tokenizer)
-                    st.success("Model warmed up and ready to use!")
-                else:
-                    st.error("Failed to load the model.")
-
-        chat_container = st.container()
-        with chat_container:
-            st.subheader("Chat")
-            input_text = st.text_input("Enter your input here...")
-            if st.button("Generate"):
-                if st.session_state.model is None or st.session_state.tokenizer is None:
-                    st.warning("Please load the model first.")
-                else:
-                    with st.spinner("Running....🐎"):
-                        streamer = get_response(
-                            st.session_state.model,
-                            st.session_state.tokenizer,
-                            input_text)
-                        st.write_stream(streamer)
-    except Exception as e:
-        st.error(f"An error occurred: {e}")
-
-
-if __name__ == "__main__":
-    main()
+import torch
+from transformers import AutoTokenizer, GenerationConfig, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from ipex_llm.transformers import AutoModelForCausalLM
+import streamlit as st
+from collections import OrderedDict, deque
+import queue
+import shutil
+import threading
+import time
+import os
+
+os.environ["SYCL_CACHE_PERSISTENT"] = "1"
+os.environ["BIGDL_LLM_XMX_DISABLED"] = "1"
+
+# Memory the cached models may take together, the least recently used ones are evicted
+MAX_MODEL_MEMORY = int(os.environ.get("MAX_MODEL_MEMORY", 8 * 1024 ** 3))
+# Written next to a saved model once it has been warmed up with a full generation
+WARM_MARKER = ".warm"
+
+# Number of tokens of the conversation kept as context
+MAX_CONTEXT_TOKENS = 1536
+# Requests waiting for the device before new ones are turned away
+MAX_QUEUED_GENERATIONS = 4
+
+
+class StopOnEvent(StoppingCriteria):
+    """
+    Stop a generation as soon as its session sets the event.
+    """
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+class GenerationJob:
+    """
+    One generation request, run by a GenerationScheduler.
+
+    Args:
+        target (callable): Runs the generation.
+        streamer (TextIteratorStreamer): The streamer the generation writes to.
+        stop (threading.Event): Set to cancel the generation.
+        on_skip (callable): Called instead of target if the job is cancelled or fails.
+    """
+
+    def __init__(self, target, streamer, stop, on_skip=None):
+        self.target = target
+        self.streamer = streamer
+        self.stop = stop
+        self.on_skip = on_skip
+        self.done = threading.Event()
+        self.submitted = time.perf_counter()
+
+    def cancel(self):
+        self.stop.set()
+
+
+class GenerationScheduler:
+    """
+    Run generations of one device one at a time from a bounded queue.
+
+    Only one generation uses the device at once, so an abandoned request no
+    longer competes with the next one, and a full queue rejects new requests
+    instead of piling them up.
+    """
+
+    def __init__(self, max_queued=MAX_QUEUED_GENERATIONS):
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self.first_token_times = deque(maxlen=100)
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, job):
+        """
+        Queue a generation.
+
+        Args:
+            job (GenerationJob): The generation to run.
+
+        Returns:
+            bool: False if the queue is full and the job was rejected.
+        """
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def record_first_token(self, seconds):
+        with self._lock:
+            self.first_token_times.append(seconds)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The queue depth, job counters and the mean time to first token in seconds.
+        """
+        with self._lock:
+            first_token_times = list(self.first_token_times)
+            return {
+                "queue_depth": self._queue.qsize(),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "time_to_first_token": sum(first_token_times) / len(first_token_times) if first_token_times else None,
+            }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            ran = False
+            try:
+                if not job.stop.is_set():
+                    with torch.inference_mode():
+                        job.target()
+                    ran = True
+            except Exception as e:
+                print(f"Generation failed: {e}")
+            finally:
+                if not ran:
+                    if job.on_skip is not None:
+                        job.on_skip()
+                    # Unblock the reader of a generation that never ran
+                    job.streamer.end()
+                with self._lock:
+                    if ran and not job.stop.is_set():
+                        self.completed += 1
+                    else:
+                        self.cancelled += 1
+                job.done.set()
+
+
+@st.cache_resource
+def get_scheduler(device="xpu"):
+    # One scheduler, and therefore one active generation, per device
+    return GenerationScheduler()
+
+
+def stream_response(job, scheduler):
+    """
+    Yield the generated text of a job and cancel the job if the reader goes away.
+
+    Streamlit stops reading when the user reruns the app, e.g. by sending a
+    new request, which closes this generator and stops the generation.
+
+    Args:
+        job (GenerationJob): The submitted generation.
+        scheduler (GenerationScheduler): The scheduler running the job.
+
+    Yields:
+        str: The generated text.
+    """
+    first_token = True
+    try:
+        for text in job.streamer:
+            if first_token and text:
+                scheduler.record_first_token(time.perf_counter() - job.submitted)
+                first_token = False
+            yield text
+    except GeneratorExit:
+        # Only a reader leaving early cancels, the streamer ends before the job finishes its turn
+        job.cancel()
+        raise
+
+
+class ChatSession:
+    """
+    Token history and key/value cache of one conversation.
+
+    The token ids of every finished turn, including the generated answer, are
+    kept together with the past_key_values returned by generate. The next
+    turn only appends its own tokens, so the model processes just the new
+    tokens instead of the whole history.
+
+    The new tokens are run through the model before generate is called, so
+    the cache covers the whole history but the last token. Remote code models
+    like Qwen feed generate only the last token once a cache is passed, no
+    matter how many tokens the cache is missing.
+    """
+
+    def __init__(self, max_tokens=MAX_CONTEXT_TOKENS):
+        self.max_tokens = max_tokens
+        self.input_ids = None
+        self.past_key_values = None
+        self.cached_tokens = 0
+        self.turn_starts = []
+        self.turns = []
+        self.job = None
+
+    def reset(self):
+        if self.job is not None:
+            self.job.cancel()
+        self.wait()
+        self.input_ids = None
+        self.past_key_values = None
+        self.cached_tokens = 0
+        self.turn_starts = []
+        self.turns = []
+
+    def wait(self):
+        # The history is only complete once the previous generation finished
+        if self.job is not None:
+            self.job.done.wait()
+            self.job = None
+
+    def append_turn(self, turn_ids):
+        """
+        Add the tokens of a new turn and drop old turns if the context is full.
+
+        Old turns are dropped until the history is half of max_tokens, so the
+        cache is rebuilt only once in a while instead of on every turn.
+
+        Args:
+            turn_ids (torch.Tensor): The token ids of the new turn.
+
+        Returns:
+            torch.Tensor: The token ids of the whole conversation.
+        """
+        self.turn_starts.append(0 if self.input_ids is None else self.input_ids.shape[1])
+        input_ids = turn_ids if self.input_ids is None else torch.cat([self.input_ids, turn_ids], dim=1)
+
+        if input_ids.shape[1] > self.max_tokens and len(self.turn_starts) > 1:
+            length = input_ids.shape[1]
+            start = next((start for start in self.turn_starts if length - start <= self.max_tokens // 2),
+                         self.turn_starts[-1])
+            input_ids = input_ids[:, start:]
+            self.turn_starts = [turn_start - start for turn_start in self.turn_starts if turn_start >= start]
+            # The cached keys and values belong to the dropped prefix
+            self.past_key_values = None
+            self.cached_tokens = 0
+
+        self.input_ids = input_ids
+        return input_ids
+
+    def rollback_turn(self):
+        # Forget the prompt of a turn that was never answered
+        start = self.turn_starts.pop()
+        self.input_ids = self.input_ids[:, :start] if start > 0 else None
+        if self.cached_tokens > start:
+            # The failed turn was prefilled already, the cache may hold part of it
+            self.past_key_values = None
+            self.cached_tokens = 0
+
+    def prefill(self, model, input_ids):
+        """
+        Extend the cache by the tokens of the new turn, all but the last one.
+
+        Args:
+            model: The model of the conversation.
+            input_ids (torch.Tensor): The token ids of the whole conversation.
+
+        Returns:
+            The past_key_values to pass to generate, or None to process the whole history.
+        """
+        if self.past_key_values is None:
+            return None
+        new_ids = input_ids[:, self.cached_tokens:-1]
+        if new_ids.shape[1] > 0:
+            self.cached_tokens = input_ids.shape[1] - 1
+            outputs = model(
+                input_ids=new_ids,
+                attention_mask=torch.ones_like(input_ids[:, :-1]),
+                past_key_values=self.past_key_values,
+                use_cache=True,
+            )
+            self.past_key_values = outputs.past_key_values
+        return self.past_key_values
+
+    def finish_turn(self, outputs):
+        self.input_ids = outputs.sequences
+        self.past_key_values = outputs.past_key_values
+        # The last generated token has not been through the model yet
+        self.cached_tokens = outputs.sequences.shape[1] - 1
+
+
+class ModelCache:
+    """
+    Loaded models of the process, evicted by memory footprint in LRU order.
+
+    Room for a model is made before it is loaded, so the device never holds
+    more than the limit. Sessions keep only the name of their model and look
+    it up here, so an evicted model is not kept alive by their state.
+    """
+
+    def __init__(self, max_bytes=MAX_MODEL_MEMORY):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, model_name):
+        with self._lock:
+            if model_name not in self._entries:
+                return None
+            self._entries.move_to_end(model_name)
+            return self._entries[model_name]
+
+    def _evict(self, footprint):
+        # Called with the lock held, returns whether a model was evicted
+        evicted = False
+        while self._entries and sum(entry["bytes"] for entry in self._entries.values()) + footprint > self.max_bytes:
+            evicted_name, _ = self._entries.popitem(last=False)
+            print(f"Evicted {evicted_name} from the model cache")
+            evicted = True
+        return evicted
+
+    def reserve(self, footprint):
+        """
+        Evict the least recently used models until a model of the given size fits.
+
+        Args:
+            footprint (int): The expected size of the model in bytes.
+        """
+        with self._lock:
+            evicted = self._evict(footprint)
+        if evicted:
+            torch.xpu.empty_cache()
+
+    def put(self, model_name, model, tokenizer):
+        """
+        Add a model and evict the least recently used ones that no longer fit.
+
+        Args:
+            model_name (str): The name of the model.
+            model: The loaded model.
+            tokenizer: The tokenizer associated with the model.
+        """
+        footprint = model.get_memory_footprint()
+        with self._lock:
+            evicted = self._evict(footprint)
+            self._entries[model_name] = {"model": model, "tokenizer": tokenizer, "bytes": footprint, "warm": False}
+        if evicted:
+            torch.xpu.empty_cache()
+
+    def mark_warm(self, model_name):
+        with self._lock:
+            if model_name in self._entries:
+                self._entries[model_name]["warm"] = True
+
+
+@st.cache_resource
+def get_model_cache():
+    # Shared by all sessions and kept across reruns of the script
+    return ModelCache()
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(directory, file_name))
+               for directory, _, file_names in os.walk(path) for file_name in file_names)
+
+
+def save_model_thread(model, model_path):
+    """
+    Save the model to the specified path in a separate thread.
+
+    The model is written to a temporary directory first, so an interrupted
+    save never leaves a partial model behind that a later load would pick up.
+
+    Args:
+        model: The model to be saved.
+        model_path (str): The path where the model will be saved.
+
+    Returns:
+        threading.Thread: The thread saving the model.
+    """
+    def save():
+        tmp_path = model_path + ".tmp"
+        try:
+            model.save_low_bit(tmp_path)
+            os.replace(tmp_path, model_path)
+            print(f"Model saved to {model_path}")
+        except Exception as e:
+            print(f"Failed to save model: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    thread = threading.Thread(target=save, daemon=False)
+    thread.start()
+    return thread
+
+
+def build_prompt(model, question: str):
+    """
+    Wrap a question in the chat format of the model.
+
+    Args:
+        model: The model that answers the question.
+        question (str): The input text for the model.
+
+    Returns:
+        str: The prompt for the model.
+    """
+    if model.name_or_path.startswith("microsoft"):
+        return f"<|user|>\n{question}<|end|>\n<|assistant|>"
+    return "user: {prompt}\n\nassistant:".format(prompt=question)
+
+
+def warmup_model(model, tokenizer, model_path=None):
+    """
+    Warm up the model by generating a dummy response.
+
+    Kernels compiled by the first generation are kept on disk by the
+    persistent SYCL cache. Once a saved model has been warmed up, a marker is
+    written next to it and later loads only run a single greedy token.
+
+    Args:
+        model: The model to be warmed up.
+        tokenizer: The tokenizer associated with the model.
+        model_path (str): The path of the saved low-bit model, if any.
+    """
+    tokenizer.pad_token = tokenizer.eos_token
+    prompt = build_prompt(model, "Hello, how are you?")
+    dummy_input = tokenizer(prompt, return_tensors="pt").to("xpu")
+    marker = os.path.join(model_path, WARM_MARKER) if model_path else None
+    if marker is not None and os.path.exists(marker):
+        _ = model.generate(**dummy_input, max_new_tokens=1, do_sample=False)
+        print("Model warmed up from the saved warm state!")
+        return
+
+    generation_config = GenerationConfig(use_cache=True,
+                                         top_k=50,
+                                         top_p=0.95,
+                                         temperature=0.7, do_sample=True,
+                                         )
+    _ = model.generate(**dummy_input, generation_config=generation_config)
+    if marker is not None and os.path.isdir(model_path):
+        open(marker, "w").close()
+    print("Model warmed up successfully!")
+
+
+def load_model(model_name: str = "Qwen/Qwen-1_8B-Chat"):
+    """
+    Load the specified model and tokenizer.
+
+    Args:
+        model_name (str): The name of the model to be loaded.
+
+    Returns:
+        tuple: The loaded model and tokenizer.
+    """
+    entry = get_model_cache().get(model_name)
+    if entry is not None:
+        return entry["model"], entry["tokenizer"]
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name, trust_remote_code=True)
+    model_path = f"./model_local_cache/{model_name}"
+
+    try:
+        if os.path.exists(model_path):
+            # The saved low-bit weights are about the size of the model on the device
+            get_model_cache().reserve(_directory_size(model_path))
+            print(f"Loading model from {model_path}")
+            model = AutoModelForCausalLM.load_low_bit(
+                model_path, cpu_embedding=True, trust_remote_code=True
+            )
+        else:
+            print(f"Loading model from {model_name}")
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                load_in_4bit=True,
+                cpu_embedding=True,
+                trust_remote_code=True
+            )
+
+        model = model.to("xpu")
+        if not os.path.exists(model_path):
+            # Saving runs next to the first requests, safetensors copies the weights back from the device
+            save_model_thread(model, model_path)
+
+        get_model_cache().put(model_name, model, tokenizer)
+        print("Model loaded successfully!")
+        return model, tokenizer
+    except Exception as e:
+        print(f"Failed to load model: {e}")
+        return None, None
+
+
+def get_response(model, tokenizer, input_text: str, session: ChatSession = None):
+    """
+    Generate a response from the model based on the input text.
+
+    The generation is queued on the scheduler of the device. A still running
+    generation of the same session is cancelled first.
+
+    Args:
+        model: The model to generate the response.
+        tokenizer: The tokenizer associated with the model.
+        input_text (str): The input text for the model.
+        session (ChatSession): The conversation to continue, or None for a single turn.
+
+    Returns:
+        GenerationJob: The queued generation, or None if the queue is full.
+    """
+    tokenizer.pad_token = tokenizer.eos_token
+    prompt = build_prompt(model, input_text)
+
+    with torch.inference_mode():
+        if session is None:
+            input_ids = tokenizer(prompt, return_tensors="pt").to("xpu")
+        else:
+            if session.job is not None:
+                session.job.cancel()
+            session.wait()
+            # Later turns continue the token history, so they start on a new line without special tokens
+            first_turn = session.input_ids is None
+            turn_ids = tokenizer(prompt if first_turn else "\n" + prompt, return_tensors="pt",
+                                 add_special_tokens=first_turn).input_ids.to("xpu")
+            input_ids = session.append_turn(turn_ids)
+            input_ids = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+        streamer = TextIteratorStreamer(
+            tokenizer, skip_prompt=session is not None, skip_special_tokens=True
+        )
+
+        generation_config = GenerationConfig(
+            use_cache=True, top_k=50, top_p=0.95,
+            temperature=0.7, do_sample=True,
+        )
+
+        stop = threading.Event()
+        kwargs = dict(
+            input_ids,
+            streamer=streamer,
+            max_new_tokens=256,
+            generation_config=generation_config,
+            stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]),
+        )
+        if session is None:
+            job = GenerationJob(lambda: model.generate(**kwargs), streamer, stop)
+        else:
+            kwargs.update(return_dict_in_generate=True)
+
+            def continue_session():
+                # Runs on the scheduler, so the prefill waits for the device like the generation
+                past_key_values = session.prefill(model, kwargs["input_ids"])
+                session.finish_turn(model.generate(**kwargs, past_key_values=past_key_values))
+
+            job = GenerationJob(continue_session, streamer, stop, on_skip=session.rollback_turn)
+
+    if not get_scheduler("xpu").submit(job):
+        if session is not None:
+            session.rollback_turn()
+        return None
+    if session is not None:
+        session.job = job
+    return job
+
+
+def main():
+    """
+    Main function to run the Streamlit app.
+    """
+    try:
+        if "model_name" not in st.session_state:
+            st.session_state.model_name = None
+        if "chat_session" not in st.session_state:
+            st.session_state.chat_session = ChatSession()
+
+        st.header("Lets chat... 🐻‍❄️")
+        selected_model = st.selectbox(
+            "Please select a model",
+            ("Qwen/Qwen-1_8B-Chat",
+             "microsoft/Phi-3-mini-4k-instruct"))
+
+        if st.button("Load Model"):
+            with st.spinner("Loading..."):
+                model, tokenizer = load_model(model_name=selected_model)
+                st.session_state.model_name = selected_model if model is not None else None
+                # The history belongs to the previous model
+                st.session_state.chat_session.reset()
+                if model is not None and tokenizer is not None:
+                    st.success("Model loaded successfully!")
+                    entry = get_model_cache().get(selected_model)
+                    if entry is None or not entry["warm"]:
+                        st.info("Warming up the model...")
+                        warmup_model(
+                            model,
+                            tokenizer,
+                            model_path=f"./model_local_cache/{selected_model}")
+                        get_model_cache().mark_warm(selected_model)
+                    st.success("Model warmed up and ready to use!")
+                else:
+                    st.error("Failed to load the model.")
+
+        chat_container = st.container()
+        with chat_container:
+            st.subheader("Chat")
+            chat_session = st.session_state.chat_session
+            if st.button("Clear conversation"):
+                chat_session.reset()
+            if st.button("Stop generation") and chat_session.job is not None:
+                chat_session.job.cancel()
+            for question, answer in chat_session.turns:
+                st.chat_message("user").markdown(question)
+                st.chat_message("assistant").markdown(answer)
+
+            input_text = st.text_input("Enter your input here...")
+            if st.button("Generate"):
+                entry = None
+                if st.session_state.model_name is not None:
+                    entry = get_model_cache().get(st.session_state.model_name)
+                    if entry is None:
+                        # Evicted to make room for another model, the cached keys and values go with it
+                        st.session_state.model_name = None
+                        chat_session.reset()
+                if entry is None:
+                    st.warning("Please load the model first.")
+                else:
+                    with st.spinner("Running....🐎"):
+                        job = get_response(
+                            entry["model"],
+                            entry["tokenizer"],
+                            input_text,
+                            session=chat_session)
+                        if job is None:
+                            st.warning("The model is busy, please try again in a moment.")
+                        else:
+                            st.chat_message("user").markdown(input_text)
+                            answer = st.chat_message("assistant").write_stream(
+                                stream_response(job, get_scheduler("xpu")))
+                            chat_session.turns.append((input_text, answer))
+
+            metrics = get_scheduler("xpu").metrics()
+            time_to_first_token = metrics["time_to_first_token"]
+            st.sidebar.caption(
+                f"Queued: {metrics['queue_depth']} · completed: {metrics['completed']} · "
+                f"cancelled: {metrics['cancelled']} · rejected: {metrics['rejected']} · time to first token: "
+                + (f"{time_to_first_token:.2f}s" if time_to_first_token is not None else "n/a"))
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from chat import build_prompt, load_model, warmup_model
+
+# Sequences decoded together in one forward pass
+MAX_BATCH_SIZE = 8
+# Requests waiting for a free slot in the batch before new ones are turned away
+MAX_WAITING_REQUESTS = 64
+# Tokens generated for a request that does not ask for a limit
+DEFAULT_MAX_NEW_TOKENS = 256
+
+
+class Request:
+    """
+    One prompt of a client, decoded as a row of the shared batch.
+
+    Args:
+        prompt_ids (list): The token ids of the prompt.
+        max_new_tokens (int): The maximum number of tokens to generate.
+    """
+
+    def __init__(self, prompt_ids, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.generated_ids = []
+        self.text = ""
+        # Receives the new text of every step, None once the request is finished
+        self.chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.submitted = time.perf_counter()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def stream(self):
+        """
+        Yields:
+            str: The generated text, as soon as the batch produced it.
+        """
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+
+def _select_rows(past_key_values, rows):
+    # Keep the cached keys and values of the given batch rows only
+    if hasattr(past_key_values, "batch_select_indices"):
+        past_key_values.batch_select_indices(rows)
+        return past_key_values
+    if isinstance(past_key_values, torch.Tensor):
+        return past_key_values.index_select(0, rows)
+    return type(past_key_values)(_select_rows(item, rows) for item in past_key_values)
+
+
+def _concat_rows(past_key_values, other):
+    # Append the cached keys and values of other rows with the same cache length to the batch
+    if hasattr(past_key_values, "layers"):
+        # Caches of recent transformers keep the tensors of every layer on a layer object
+        for layer, other_layer in zip(past_key_values.layers, other.layers):
+            layer.keys = torch.cat([layer.keys, other_layer.keys], dim=0)
+            layer.values = torch.cat([layer.values, other_layer.values], dim=0)
+        return past_key_values
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return type(past_key_values).from_legacy_cache(
+            _concat_rows(past_key_values.to_legacy_cache(), other.to_legacy_cache()))
+    if isinstance(past_key_values, torch.Tensor):
+        return torch.cat([past_key_values, other], dim=0)
+    return type(past_key_values)(_concat_rows(item, other_item) for item, other_item in zip(past_key_values, other))
+
+
+class BatchScheduler:
+    """
+    Decode the requests of all clients together, one token per step.
+
+    Every step runs a single forward pass over the active batch. Finished or
+    cancelled rows leave the batch right after the step that ended them, and
+    waiting requests join it as soon as slots are free. Joining requests are
+    left padded to the cache length of the batch and prefilled alone, then
+    their cached keys and values are appended to those of the batch. Only a
+    prompt longer than the batch makes the whole batch prefill again. Apart
+    from joins, only the new token of every row goes through the model.
+
+    Args:
+        model: The loaded model.
+        tokenizer: The tokenizer associated with the model.
+        max_batch_size (int): The maximum number of sequences decoded together.
+        max_waiting (int): The maximum number of requests waiting for a slot.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, max_waiting=MAX_WAITING_REQUESTS,
+                 device="xpu", top_k=50, top_p=0.95, temperature=0.7):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.device = device
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        eos_token_id = model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+        self.pad_token_id = next(
+            (token_id for token_id in (tokenizer.pad_token_id, model.generation_config.pad_token_id, eos_token_id)
+             if isinstance(token_id, int)), 0)
+
+        self._waiting = queue.Queue(maxsize=max_waiting)
+        self._lock = threading.Lock()
+        self.active = []
+        self.steps = 0
+        self.batched_tokens = 0
+        self.completed = 0
+        self.rejected = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, prompt, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        """
+        Queue a prompt for the next free slot of the batch.
+
+        Args:
+            prompt (str): The question of the client.
+            max_new_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            Request: The queued request, or None if too many requests are waiting.
+        """
+        prompt_ids = self.tokenizer(build_prompt(self.model, prompt)).input_ids
+        request = Request(prompt_ids, max_new_tokens)
+        try:
+            self._waiting.put_nowait(request)
+            return request
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return None
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The batch size, waiting requests, counters and the mean number of rows per step.
+        """
+        with self._lock:
+            return {
+                "active": len(self.active),
+                "waiting": self._waiting.qsize(),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "steps": self.steps,
+                "mean_batch_size": self.batched_tokens / self.steps if self.steps else 0.0,
+            }
+
+    def _admit(self, block):
+        # Move waiting requests into free slots, returns the requests that joined
+        admitted = []
+        while len(self.active) < self.max_batch_size:
+            try:
+                request = self._waiting.get(block=block and not self.active and not admitted)
+            except queue.Empty:
+                break
+            if not request.cancelled.is_set():
+                self.active.append(request)
+                admitted.append(request)
+        return admitted
+
+    def _sample(self, logits):
+        # Top-k and top-p sampling with temperature, the settings of the chat app
+        logits = logits.float() / self.temperature
+        top_logits, top_indices = torch.topk(logits, min(self.top_k, logits.shape[-1]), dim=-1)
+        probs = torch.softmax(top_logits, dim=-1)
+        cumulative = torch.cumsum(probs, dim=-1)
+        probs = probs.masked_fill(cumulative - probs > self.top_p, 0.0)
+        choice = torch.multinomial(probs / probs.sum(dim=-1, keepdim=True), 1)
+        return top_indices.gather(-1, choice).squeeze(-1)
+
+    def _prefill(self):
+        # Left pad every sequence of the batch, so new tokens line up in the last column
+        sequences = [request.prompt_ids + request.generated_ids for request in self.active]
+        length = max(len(sequence) for sequence in sequences)
+        input_ids = torch.tensor(
+            [[self.pad_token_id] * (length - len(sequence)) + sequence for sequence in sequences],
+            device=self.device)
+        attention_mask = torch.tensor(
+            [[0] * (length - len(sequence)) + [1] * len(sequence) for sequence in sequences],
+            device=self.device)
+        return input_ids, attention_mask, None
+
+    def _join(self, requests, input_ids, attention_mask, past_key_values):
+        # Prefill the joining rows alone up to their last token, which is decoded with the next step
+        length = attention_mask.shape[1] - 1
+        sequences = [request.prompt_ids + request.generated_ids for request in requests]
+        if any(len(sequence) < 2 or len(sequence) - 1 > length for sequence in sequences):
+            # Rows longer than the cache of the batch, or without a prefix, cannot be appended to it
+            return self._prefill()
+
+        prefix_ids = torch.tensor(
+            [[self.pad_token_id] * (length - len(sequence) + 1) + sequence[:-1] for sequence in sequences],
+            device=self.device)
+        prefix_mask = torch.tensor(
+            [[0] * (length - len(sequence) + 1) + [1] * len(sequence) for sequence in sequences],
+            device=self.device)
+        with torch.inference_mode():
+            outputs = self._forward(prefix_ids, prefix_mask[:, :-1], None)
+
+        input_ids = torch.cat([input_ids, torch.tensor([[sequence[-1]] for sequence in sequences],
+                                                       device=self.device)])
+        attention_mask = torch.cat([attention_mask, prefix_mask])
+        return input_ids, attention_mask, _concat_rows(past_key_values, outputs.past_key_values)
+
+    def _forward(self, input_ids, attention_mask, past_key_values):
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+
+    def _step(self, input_ids, attention_mask, past_key_values):
+        outputs = self._forward(input_ids, attention_mask, past_key_values)
+        return self._sample(outputs.logits[:, -1, :]), outputs.past_key_values
+
+    def _emit(self, request, token_id):
+        # Send the new text of a row, an incomplete multi-byte character waits for the next token
+        request.generated_ids.append(token_id)
+        text = self.tokenizer.decode(request.generated_ids, skip_special_tokens=True)
+        if text.endswith("\ufffd"):
+            return
+        if len(text) > len(request.text):
+            request.chunks.put(text[len(request.text):])
+        request.text = text
+
+    def _run(self):
+        input_ids = attention_mask = past_key_values = None
+        while True:
+            try:
+                admitted = self._admit(block=True)
+                if not self.active:
+                    # Every dequeued request was cancelled already
+                    past_key_values = None
+                    continue
+                if past_key_values is None:
+                    input_ids, attention_mask, past_key_values = self._prefill()
+                elif admitted:
+                    input_ids, attention_mask, past_key_values = self._join(
+                        admitted, input_ids, attention_mask, past_key_values)
+
+                with torch.inference_mode():
+                    next_tokens, past_key_values = self._step(input_ids, attention_mask, past_key_values)
+
+                finished = []
+                for row, (request, token_id) in enumerate(zip(self.active, next_tokens.tolist())):
+                    if token_id not in self.eos_token_ids:
+                        self._emit(request, token_id)
+                    if (token_id in self.eos_token_ids or request.cancelled.is_set()
+                            or len(request.generated_ids) >= request.max_new_tokens):
+                        finished.append(row)
+
+                with self._lock:
+                    self.steps += 1
+                    self.batched_tokens += len(self.active)
+                    self.completed += len(finished)
+
+                input_ids = next_tokens.unsqueeze(-1)
+                attention_mask = torch.cat([attention_mask, torch.ones_like(input_ids)], dim=-1)
+                if finished:
+                    for row in finished:
+                        self.active[row].chunks.put(None)
+                    rows = [row for row in range(len(self.active)) if row not in finished]
+                    self.active = [self.active[row] for row in rows]
+                    if not self.active:
+                        past_key_values = None
+                        continue
+                    rows = torch.tensor(rows, device=self.device)
+                    input_ids = input_ids.index_select(0, rows)
+                    attention_mask = attention_mask.index_select(0, rows)
+                    past_key_values = _select_rows(past_key_values, rows)
+            except Exception as e:
+                print(f"Batch generation failed: {e}")
+                # Fail the requests of the batch, the server keeps serving new ones
+                for request in self.active:
+                    request.chunks.put(None)
+                self.active = []
+                past_key_values = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set on the class by `serve`
+    scheduler: BatchScheduler = None
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, dict(status="ok", **self.scheduler.metrics()))
+        else:
+            self._reply(404, {"error": "unknown endpoint"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._reply(404, {"error": "unknown endpoint"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            prompt = payload["prompt"]
+            max_new_tokens = int(payload.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS))
+        except (ValueError, KeyError) as e:
+            self._reply(400, {"error": f"invalid request: {e}"})
+            return
+
+        request = self.scheduler.submit(prompt, max_new_tokens)
+        if request is None:
+            self._reply(503, {"error": "too many waiting requests"})
+            return
+
+        # Every chunk of the response is one JSON line with the new text
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for text in request.stream():
+                self._write_chunk(json.dumps({"text": text}).encode() + b"\n")
+            self._write_chunk(b"")
+        except OSError:
+            # The client went away, its row leaves the batch after the next step
+            request.cancel()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(scheduler, host="127.0.0.1", port=8766):
+    """
+    Serve streamed generations of a batch scheduler until interrupted.
+
+    Args:
+        scheduler (BatchScheduler): The scheduler shared by all requests.
+        host (str): The interface to listen on.
+        port (int): The TCP port to listen on.
+    """
+    handler = type("Handler", (_Handler,), {"scheduler": scheduler})
+    with ThreadingHTTPServer((host, port), handler) as http_server:
+        print(f"Serving on http://{host}:{port}")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    """
+    Load a chat model and serve it without the Streamlit UI.
+    """
+    parser = argparse.ArgumentParser(description="Serve a chat model with continuous batching.")
+    parser.add_argument("--model", default="Qwen/Qwen-1_8B-Chat", help="The model to serve.")
+    parser.add_argument("--host", default="127.0.0.1", help="The interface to listen on.")
+    parser.add_argument("--port", type=int, default=8766, help="The port to listen on.")
+    parser.add_argument("--max_batch_size", type=int, default=MAX_BATCH_SIZE,
+                        help="The maximum number of sequences decoded together.")
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(model_name=args.model)
+    if model is None:
+        raise SystemExit(f"Failed to load {args.model}")
+    warmup_model(model, tokenizer, model_path=f"./model_local_cache/{args.model}")
+    serve(BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
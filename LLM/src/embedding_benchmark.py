@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import time
+
+from langchain import text_splitter
+
+import rag_embeddings
+
+# Markdown files of the repository, so every run embeds the same text
+DEFAULT_CORPUS = [
+    os.path.join(os.path.dirname(__file__), "..", "README_RAG.md"),
+    os.path.join(os.path.dirname(__file__), "..", "data", "README.md"),
+]
+
+
+def load_corpus(paths, chunks=512, chunk_size=500, overlap=50):
+    """
+    Split the corpus files into a fixed number of chunks.
+
+    The files are repeated until there are enough chunks, every repetition is
+    numbered so that no backend can answer from a cache.
+
+    Args:
+        paths (list): The text files of the corpus.
+        chunks (int): The number of chunks to return.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+
+    Returns:
+        list: The text of the chunks.
+    """
+    splitter = text_splitter.RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+    texts = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            texts.extend(splitter.split_text(f.read()))
+    if not texts:
+        raise ValueError("The corpus is empty")
+    return [f"{index // len(texts)}: {texts[index % len(texts)]}" for index in range(chunks)]
+
+
+def benchmark(embedding_type, corpus, model_name=None, batch_size=rag_embeddings.DEFAULT_BATCH_SIZE,
+              threads=rag_embeddings.DEFAULT_THREADS):
+    """
+    Measure the embedding throughput of a backend.
+
+    Loading the model and a first small batch are not part of the measured time.
+
+    Args:
+        embedding_type (str): The type of embedding to measure.
+        corpus (list): The text of the chunks to embed.
+        model_name (str): The name of the embedding model, None for the default of the type.
+        batch_size (int): The number of chunks embedded together.
+        threads (int): The number of CPU threads of the backend.
+
+    Returns:
+        dict: The settings, the load time and the chunks embedded per second.
+    """
+    start_time = time.perf_counter()
+    embedding_fn = rag_embeddings.create_embedding_fn(embedding_type, model_name, batch_size, threads)
+    embedding_fn.embed_documents(corpus[:2])
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    embedding_fn.embed_documents(corpus)
+    elapsed = time.perf_counter() - start_time
+    return {
+        "embedding_type": embedding_type,
+        "model_name": model_name or rag_embeddings.DEFAULT_EMBEDDING_MODELS.get(embedding_type),
+        "batch_size": batch_size,
+        "threads": threads,
+        "chunks": len(corpus),
+        "load_seconds": round(load_time, 3),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(corpus) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the chunks per second of the RAG embedding backends.")
+    parser.add_argument("--types", nargs="+", default=["huggingface", "fastembed"],
+                        choices=rag_embeddings.EMBEDDING_TYPES, help="The embedding types to measure.")
+    parser.add_argument("--ollama_model", help="The Ollama model of the ollama embeddings.")
+    parser.add_argument("--corpus", nargs="+", default=DEFAULT_CORPUS, help="The text files to embed.")
+    parser.add_argument("--chunks", type=int, default=512, help="The number of chunks to embed.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[rag_embeddings.DEFAULT_BATCH_SIZE],
+                        help="The batch sizes to measure.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[rag_embeddings.DEFAULT_THREADS],
+                        help="The thread counts to measure.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, chunks=args.chunks)
+    results = []
+    for embedding_type in args.types:
+        model_name = args.ollama_model if embedding_type == "ollama" else None
+        for batch_size in args.batch_sizes:
+            for threads in args.threads:
+                try:
+                    result = benchmark(embedding_type, corpus, model_name, batch_size, threads)
+                except Exception as e:
+                    print(f"{embedding_type} failed: {e}")
+                    continue
+                results.append(result)
+                print(f"{embedding_type:12} batch {batch_size:4} threads {threads:3}: "
+                      f"{result['chunks_per_second']:8.1f} chunks/s (load {result['load_seconds']:.1f}s)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
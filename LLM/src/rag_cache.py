@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 1000
+# Cosine similarity from which two questions count as the same question
+DEFAULT_SIMILARITY = 0.95
+
+
+def normalize_query(query):
+    """
+    Normalize a question for exact matching.
+
+    Args:
+        query (str): The question.
+
+    Returns:
+        str: The lowercased question with collapsed whitespace and without trailing punctuation.
+    """
+    return re.sub(r"[\s?!.]+$", "", " ".join(query.lower().split()))
+
+
+class ResultCache:
+    """
+    Results keyed by a namespace and a normalized question, with TTL and LRU eviction.
+
+    A lookup first tries the exact question, then the most similar question
+    of the same namespace by the cosine similarity of the question
+    embeddings.
+
+    Args:
+        ttl (float): The seconds a result stays valid.
+        max_entries (int): The number of results kept, the least recently used are evicted.
+        similarity (float): The minimum cosine similarity of a near-identical question, None for exact matches only.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, similarity=DEFAULT_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        for key in [key for key, (_, expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+
+    def get(self, namespace, query, embedding=None, similarity=None):
+        """
+        Look up the result of a question.
+
+        Args:
+            namespace (tuple): The context the result belongs to, e.g. the store or the retrieved chunks.
+            query (str): The normalized question.
+            embedding (list): The embedding of the question, None for exact matching only.
+            similarity (float): Overrides the minimum cosine similarity of the cache.
+
+        Returns:
+            The cached result, or None.
+        """
+        similarity = self.similarity if similarity is None else similarity
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            key = (namespace, query)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return self._entries[key][0]
+
+            if embedding is not None and similarity is not None:
+                vector = self._unit(embedding)
+                best_key, best_score = None, similarity
+                for (entry_namespace, entry_query), (_, _, entry_vector) in self._entries.items():
+                    if entry_namespace != namespace or entry_vector is None:
+                        continue
+                    score = float(np.dot(vector, entry_vector))
+                    if score >= best_score:
+                        best_key, best_score = (entry_namespace, entry_query), score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.similar_hits += 1
+                    return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, namespace, query, value, embedding=None):
+        """
+        Store the result of a question.
+
+        Args:
+            namespace (tuple): The context the result belongs to.
+            query (str): The normalized question.
+            value: The result.
+            embedding (list): The embedding of the question, enables similarity matches.
+        """
+        vector = None if embedding is None else self._unit(embedding)
+        with self._lock:
+            self._entries[(namespace, query)] = (value, time.time() + self.ttl, vector)
+            self._entries.move_to_end((namespace, query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The number of entries, hits and misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+            }
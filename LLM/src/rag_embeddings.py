@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_community import embeddings
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_core.embeddings import Embeddings
+
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+EMBEDDING_TYPES = ("ollama", "huggingface", "nomic", "fastembed")
+
+# Model of every embedding type, the ollama embeddings use the selected chat model
+DEFAULT_EMBEDDING_MODELS = {
+    "huggingface": "sentence-transformers/paraphrase-MiniLM-L3-v2",
+    "nomic": "nomic-embed-text-v1.5",
+    "fastembed": "BAAI/bge-small-en-v1.5",
+}
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_THREADS = os.cpu_count() or 4
+# Chunk embeddings of every model, shared by all documents and vector stores
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+
+def load_embedding_backend(embedding_type="huggingface", model_name=None, threads=DEFAULT_THREADS):
+    """
+    Load the model of an embedding type, shared by every batch size and thread count.
+
+    Args:
+        embedding_type (str): The type of embedding to use.
+        model_name (str): The name of the model to use for embeddings, None for the default of the type.
+        threads (int): The number of CPU threads of fastembed, which are fixed once its model is loaded.
+
+    Returns:
+        Embeddings: The loaded embedding backend.
+    """
+    model_name = model_name or DEFAULT_EMBEDDING_MODELS.get(embedding_type)
+    print(f"Initializing {embedding_type} model with {model_name}...")
+    if embedding_type == "ollama":
+        return embeddings.OllamaEmbeddings(model=model_name, base_url=OLLAMA_BASE_URL)
+    elif embedding_type == "huggingface":
+        return embeddings.HuggingFaceEmbeddings(model_name=model_name)
+    elif embedding_type == "nomic":
+        return embeddings.NomicEmbeddings(model_name=model_name)
+    elif embedding_type == "fastembed":
+        return FastEmbedEmbeddings(model_name=model_name, threads=threads)
+    else:
+        raise ValueError(f"Unsupported embedding type: {embedding_type}")
+
+
+class TunedEmbeddings(Embeddings):
+    """
+    Apply a batch size and a thread count to a shared embedding backend on every call.
+
+    The settings go into a shallow copy of the backend, which shares its
+    loaded model. Only the torch thread pool of sentence-transformers is
+    global to the process, so those calls are not run concurrently.
+
+    Args:
+        backend (Embeddings): The embedding backend returned by `load_embedding_backend`.
+        batch_size (int): The number of chunks embedded together, where the backend supports it.
+        threads (int): The number of CPU threads of the backend, where the backend supports it.
+    """
+
+    _torch_lock = threading.Lock()
+
+    def __init__(self, backend, batch_size=DEFAULT_BATCH_SIZE, threads=DEFAULT_THREADS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+
+    def _embed(self, method, *args):
+        backend = self.backend
+        if isinstance(backend, embeddings.OllamaEmbeddings):
+            return getattr(backend.model_copy(update={"num_thread": self.threads}), method)(*args)
+        if isinstance(backend, FastEmbedEmbeddings):
+            return getattr(backend.model_copy(update={"batch_size": self.batch_size}), method)(*args)
+        if isinstance(backend, embeddings.HuggingFaceEmbeddings):
+            import torch
+
+            backend = backend.model_copy(
+                update={"encode_kwargs": {**backend.encode_kwargs, "batch_size": self.batch_size}})
+            with self._torch_lock:
+                torch.set_num_threads(self.threads)
+                return getattr(backend, method)(*args)
+        return getattr(backend, method)(*args)
+
+    def embed_documents(self, texts):
+        return self._embed("embed_documents", texts)
+
+    def embed_query(self, text):
+        return self._embed("embed_query", text)
+
+
+def create_embedding_fn(
+        embedding_type="huggingface",
+        model_name=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        threads=DEFAULT_THREADS):
+    """
+    Create the embedding function of an embedding type.
+
+    Args:
+        embedding_type (str): The type of embedding to use.
+        model_name (str): The name of the model to use for embeddings, None for the default of the type.
+        batch_size (int): The number of chunks embedded together, where the backend supports it.
+        threads (int): The number of CPU threads of the backend, where the backend supports it.
+
+    Returns:
+        Embeddings: The initialized embedding function.
+    """
+    return TunedEmbeddings(load_embedding_backend(embedding_type, model_name, threads), batch_size, threads)
+
+
+def chunk_digest(text):
+    """
+    Hash the text of a chunk with its whitespace normalized.
+
+    Args:
+        text (str): The text of the chunk.
+
+    Returns:
+        bytes: The SHA-256 digest of the normalized text.
+    """
+    return hashlib.sha256(" ".join(text.split()).encode()).digest()
+
+
+class _FileLock:
+    # Exclusive lock on a file, held by one process at a time
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if os.name == "nt":
+            import msvcrt
+
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+class EmbeddingCache:
+    """
+    Chunk embeddings of one model, keyed by the digest of the chunk text.
+
+    The vectors are appended as float32 rows to a single file that is read
+    through a memory map, and the digests are appended to a second file in
+    the same order. Row numbers come from the length of the digest file,
+    read and extended under a file lock, so every writer of the directory
+    agrees on them. Rows written without their digest, e.g. after a crash,
+    are overwritten by the next write.
+
+    Use `get_embedding_cache` to share one instance per model directory.
+
+    Args:
+        cache_dir (str): The directory of the caches of all models.
+        model_id (str): The embedding type and model, vectors of different models are kept apart.
+    """
+
+    def __init__(self, cache_dir, model_id):
+        self.directory = os.path.join(cache_dir, hashlib.sha256(model_id.encode()).hexdigest()[:32])
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._keys_path = os.path.join(self.directory, "keys.bin")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._file_lock = _FileLock(os.path.join(self.directory, "lock"))
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._vectors = None
+        self.dim = None
+        # Rows of the digest file read so far, and the row of every digest
+        self._file_rows = 0
+        self._rows = {}
+        with self._lock:
+            self._refresh()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _complete_rows(self):
+        # Rows that have both their vector and their digest on disk
+        if not self.dim or not os.path.exists(self._keys_path) or not os.path.exists(self._vectors_path):
+            return 0
+        return min(os.path.getsize(self._keys_path) // 32,
+                   os.path.getsize(self._vectors_path) // (4 * self.dim))
+
+    def _refresh(self):
+        # Pick up the rows other writers appended since the last read
+        if self.dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        rows = self._complete_rows()
+        if rows <= self._file_rows:
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._file_rows * 32)
+            keys = f.read((rows - self._file_rows) * 32)
+        for row in range(self._file_rows, rows):
+            offset = (row - self._file_rows) * 32
+            self._rows.setdefault(keys[offset:offset + 32], row)
+        self._file_rows = rows
+
+    def get(self, digests):
+        """
+        Look up the embeddings of chunks.
+
+        Args:
+            digests (list): The digests of the chunks.
+
+        Returns:
+            list: The embedding of every chunk, None for the chunks that are not cached.
+        """
+        with self._lock:
+            self._refresh()
+            rows = [self._rows.get(digest) for digest in digests]
+            if all(row is None for row in rows):
+                return [None] * len(digests)
+            if self._vectors is None or self._vectors.shape[0] < self._file_rows:
+                self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                          shape=(self._file_rows, self.dim))
+            return [None if row is None else self._vectors[row].tolist() for row in rows]
+
+    def put(self, digests, vectors):
+        """
+        Add the embeddings of chunks.
+
+        Args:
+            digests (list): The digests of the chunks.
+            vectors (list): The embedding of every chunk.
+        """
+        with self._lock, self._file_lock:
+            self._refresh()
+            new = {}
+            for digest, vector in zip(digests, vectors):
+                if digest not in self._rows:
+                    new[digest] = vector
+            if not new:
+                return
+            array = np.asarray(list(new.values()), dtype=np.float32)
+            if self.dim is None:
+                self.dim = array.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"model_id": self.model_id, "dim": self.dim}, f)
+
+            # Partial rows of an interrupted write are overwritten, the vectors are
+            # written first, so every stored digest has its row
+            rows = self._complete_rows()
+            for path, data, row_size in ((self._vectors_path, array.tobytes(), 4 * self.dim),
+                                         (self._keys_path, b"".join(new), 32)):
+                with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                    f.seek(rows * row_size)
+                    f.write(data)
+                    f.truncate()
+            for row, digest in enumerate(new, rows):
+                self._rows[digest] = row
+            self._file_rows = rows + len(new)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(cache_dir, model_id):
+    """
+    Return the embedding cache of a model, one instance per cache directory and model in the process.
+
+    Args:
+        cache_dir (str): The directory of the caches of all models.
+        model_id (str): The embedding type and model.
+
+    Returns:
+        EmbeddingCache: The shared cache.
+    """
+    key = (os.path.abspath(cache_dir), model_id)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(cache_dir, model_id)
+        return _caches[key]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embed only the chunks that are not in the embedding cache yet.
+
+    Args:
+        embedding_fn (Embeddings): The embedding function computing missing embeddings.
+        cache (EmbeddingCache): The cache of the embedding model.
+        model_name (str): The name of the embedding model.
+    """
+
+    def __init__(self, embedding_fn, cache, model_name=None):
+        self.embedding_fn = embedding_fn
+        self.cache = cache
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        digests = [chunk_digest(text) for text in texts]
+        vectors = self.cache.get(digests)
+        missing = [index for index, vector in enumerate(vectors) if vector is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # Duplicated chunks of one call are embedded once
+            unique = {digests[index]: texts[index] for index in missing}
+            embedded = dict(zip(unique, self.embedding_fn.embed_documents(list(unique.values()))))
+            self.cache.put(list(embedded), list(embedded.values()))
+            for index in missing:
+                vectors[index] = list(embedded[digests[index]])
+        return vectors
+
+    def embed_query(self, text):
+        return self.embedding_fn.embed_query(text)
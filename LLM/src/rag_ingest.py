@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from bs4 import BeautifulSoup
+from langchain import text_splitter
+
+# Pages downloaded at the same time, also the size of the connection pool
+DEFAULT_CONCURRENCY = 32
+# Chunks handed to the embedder at once
+DEFAULT_BATCH_SIZE = 256
+FETCH_TIMEOUT = 30
+
+
+def parse_sitemap(xml_text):
+    """
+    Read the page URLs of a sitemap.
+
+    Args:
+        xml_text (str): The sitemap XML.
+
+    Returns:
+        tuple: The page URLs and the URLs of nested sitemaps.
+    """
+    root = ET.fromstring(xml_text)
+    locations = [element.text.strip() for element in root.iter() if element.tag.endswith("loc") and element.text]
+    if root.tag.endswith("sitemapindex"):
+        return [], locations
+    return locations, []
+
+
+def split_page(url, html, chunk_size, overlap):
+    """
+    Extract the text of a page and split it into chunks, run on the worker pool.
+
+    Args:
+        url (str): The URL of the page.
+        html (str): The HTML of the page.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+
+    Returns:
+        list: The text and metadata of every chunk.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {"source": url}
+    if soup.title is not None and soup.title.string:
+        metadata["title"] = soup.title.string.strip()
+    text = soup.get_text()
+    splitter = text_splitter.RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+    return [(chunk, metadata) for chunk in splitter.split_text(text)]
+
+
+class IngestStats:
+    """
+    Progress of an ingestion, updated while pages are fetched, split and embedded.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.failed = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.start_time = time.perf_counter()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        return (f"{self.pages} pages ({self.failed} failed), {self.embedded} chunks "
+                f"in {elapsed:.1f} seconds, {self.pages / elapsed if elapsed else 0:.1f} pages/s")
+
+
+async def _fetch(session, url):
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.text(errors="replace")
+
+
+async def expand_sitemaps(session, urls):
+    """
+    Replace every sitemap in a URL list by the pages it lists, nested sitemaps included.
+
+    Args:
+        session (aiohttp.ClientSession): The HTTP session.
+        urls (list): Page and sitemap URLs, sitemaps end with `.xml`.
+
+    Returns:
+        list: The page URLs without duplicates, in their original order.
+    """
+    pages = []
+    sitemaps = [url for url in urls if url.endswith(".xml")]
+    pages.extend(url for url in urls if not url.endswith(".xml"))
+    seen = set()
+    while sitemaps:
+        sitemaps = [url for url in sitemaps if url not in seen]
+        seen.update(sitemaps)
+        nested = []
+        for xml_text in await asyncio.gather(*(_fetch(session, url) for url in sitemaps)):
+            page_urls, sitemap_urls = parse_sitemap(xml_text)
+            pages.extend(page_urls)
+            nested.extend(sitemap_urls)
+        sitemaps = nested
+    return list(dict.fromkeys(pages))
+
+
+async def _ingest(urls, add_chunks, executor, stats, concurrency, batch_size, chunk_size, overlap):
+    loop = asyncio.get_running_loop()
+    # Bounded, so fetching and splitting wait for the embedder instead of piling up chunks
+    chunks = asyncio.Queue(maxsize=batch_size * 4)
+
+    async def embed():
+        batch = []
+        while True:
+            chunk = await chunks.get()
+            if chunk is not None:
+                batch.append(chunk)
+            if batch and (chunk is None or len(batch) >= batch_size):
+                # The embedder runs in a thread while the next pages are fetched and split
+                await asyncio.to_thread(add_chunks, batch)
+                stats.embedded += len(batch)
+                batch = []
+            if chunk is None:
+                return
+
+    async def process(session, url):
+        try:
+            html = await _fetch(session, url)
+            page_chunks = await loop.run_in_executor(executor, split_page, url, html, chunk_size, overlap)
+        except Exception as e:
+            print(f"Failed to ingest {url}: {e}")
+            stats.failed += 1
+            return
+        stats.pages += 1
+        stats.chunks += len(page_chunks)
+        for chunk in page_chunks:
+            await chunks.put(chunk)
+
+    async def unless_embedder_fails(awaitable):
+        # The fetchers block on the full queue once the embedder is gone, so its failure stops them
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait([task, embedder], return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            # The embedder only returns after the end of the chunks, so it has failed
+            embedder.result()
+        return task.result()
+
+    embedder = asyncio.create_task(embed())
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            urls = await expand_sitemaps(session, urls)
+            pending = iter(urls)
+
+            async def fetcher():
+                # Every fetcher takes the next URL, so only `concurrency` pages are in flight
+                for url in pending:
+                    await process(session, url)
+
+            await unless_embedder_fails(asyncio.gather(*(fetcher() for _ in range(concurrency))))
+        await unless_embedder_fails(chunks.put(None))
+        await embedder
+    finally:
+        # Stops the embedder when fetching failed, the batch in flight is not waited for
+        embedder.cancel()
+
+
+def ingest(urls, add_chunks, concurrency=DEFAULT_CONCURRENCY, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+           chunk_size=3000, overlap=200):
+    """
+    Fetch, split and embed many pages with the three stages overlapping.
+
+    Pages are downloaded concurrently over a pooled connection, split on a
+    process pool and their chunks handed to add_chunks in batches, while
+    the next pages are still downloading.
+
+    Args:
+        urls (list): Page URLs and sitemap URLs, sitemaps end with `.xml`.
+        add_chunks (callable): Receives lists of (text, metadata) chunks, e.g. to embed and store them.
+        concurrency (int): The number of pages downloaded at the same time.
+        workers (int): The number of processes splitting pages, None for one per CPU.
+        batch_size (int): The number of chunks passed to add_chunks at once.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+
+    Returns:
+        IngestStats: The number of pages and chunks and the elapsed time.
+    """
+    stats = IngestStats()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        asyncio.run(_ingest(urls, add_chunks, executor, stats, concurrency, batch_size, chunk_size, overlap))
+    return stats
+
+
+def chunk_id(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def vector_store_writer(vector_store):
+    """
+    Create an add_chunks callback that stores chunks in a vector store.
+
+    Chunks are identified by the hash of their text, so a chunk shared by
+    several pages is stored once and ingesting a page again updates it in place.
+
+    Args:
+        vector_store (VectorStore): The vector store to add the chunks to.
+
+    Returns:
+        tuple: The callback and the set of ids of all chunks it stored.
+    """
+    ids = set()
+    lock = threading.Lock()
+
+    def add_chunks(chunks):
+        unique = {chunk_id(text): (text, metadata) for text, metadata in chunks}
+        vector_store.add_texts(
+            texts=[text for text, _ in unique.values()],
+            metadatas=[metadata for _, metadata in unique.values()],
+            ids=list(unique))
+        with lock:
+            ids.update(unique)
+
+    return add_chunks, ids
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Set on the class by `serve_stub`
+    pages = 0
+
+    def do_GET(self):
+        if self.path == "/sitemap.xml":
+            locations = "".join(f"<url><loc>http://{self.headers['Host']}/page/{index}</loc></url>"
+                                for index in range(self.pages))
+            body = f'<?xml version="1.0"?><urlset>{locations}</urlset>'
+        elif self.path.startswith("/page/"):
+            index = self.path.rsplit("/", 1)[1]
+            paragraphs = "".join(f"<p>Page {index}, paragraph {paragraph}: " + "lorem ipsum dolor sit amet " * 20
+                                 + "</p>" for paragraph in range(20))
+            body = f"<html><head><title>Page {index}</title></head><body>{paragraphs}</body></html>"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(pages, port=0):
+    """
+    Serve a local site with a sitemap of synthetic pages in a background thread.
+
+    Args:
+        pages (int): The number of pages listed in /sitemap.xml.
+        port (int): The port to listen on, 0 for any free port.
+
+    Returns:
+        ThreadingHTTPServer: The running server, stop it with shutdown().
+    """
+    handler = type("Handler", (_StubHandler,), {"pages": pages})
+    http_server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest many pages, or measure the ingestion against a local stub site.")
+    parser.add_argument("urls", nargs="*", help="Page or sitemap URLs, ingested without embedding.")
+    parser.add_argument("--stub_pages", type=int, default=1000, help="Pages of the local stub site without urls.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Pages downloaded at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes splitting pages.")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Chunks per embedder call.")
+    args = parser.parse_args()
+
+    http_server = None
+    urls = args.urls
+    if not urls:
+        http_server = serve_stub(args.stub_pages)
+        urls = [f"http://127.0.0.1:{http_server.server_address[1]}/sitemap.xml"]
+    try:
+        stats = ingest(urls, lambda chunks: None, concurrency=args.concurrency, workers=args.workers,
+                       batch_size=args.batch_size)
+        print(stats.summary())
+    finally:
+        if http_server is not None:
+            http_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
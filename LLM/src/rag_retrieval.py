@@ -0,0 +1,138 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+from langchain.retrievers.document_compressors import CrossEncoderReranker
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from langchain_community.cross_encoders.base import BaseCrossEncoder
+from langchain_community.retrievers import BM25Retriever
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Candidates of every retriever passed on to fusion and reranking
+DEFAULT_FETCH_K = 10
+# Query and chunk pairs whose rerank score is kept
+MAX_CACHED_SCORES = 10000
+
+
+def tokenize(text):
+    # Lowercased words and numbers, so punctuation does not split the vocabulary
+    return re.findall(r"\w+", text.lower())
+
+
+def stored_documents(vector_store):
+    """
+    Read the chunks of a Chroma vector store back as documents.
+
+    Args:
+        vector_store (VectorStore): The vector store.
+
+    Returns:
+        list: The documents of all chunks.
+    """
+    stored = vector_store.get(include=["documents", "metadatas"])
+    return [Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])]
+
+
+class CachedCrossEncoder(BaseCrossEncoder):
+    """
+    Cross-encoder that scores every query and chunk pair only once.
+
+    Args:
+        model (BaseCrossEncoder): The cross-encoder scoring new pairs.
+        max_entries (int): The number of scores kept, the least recently used are evicted.
+    """
+
+    def __init__(self, model, max_entries=MAX_CACHED_SCORES):
+        self.model = model
+        self.max_entries = max_entries
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query, text):
+        return hashlib.sha256(f"{query}\0{text}".encode()).digest()
+
+    def score(self, text_pairs):
+        keys = [self._key(query, text) for query, text in text_pairs]
+        with self._lock:
+            scores = [self._scores.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._scores.move_to_end(key)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            for index, score in zip(missing, self.model.score([text_pairs[index] for index in missing])):
+                scores[index] = float(score)
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            for index in missing:
+                self._scores[keys[index]] = scores[index]
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+        return scores
+
+
+def load_reranker(model_name=DEFAULT_RERANK_MODEL, max_entries=MAX_CACHED_SCORES):
+    """
+    Load a cross-encoder for reranking, wrapped in a score cache.
+
+    Args:
+        model_name (str): The name of the cross-encoder model.
+        max_entries (int): The number of scores kept.
+
+    Returns:
+        CachedCrossEncoder: The reranking model.
+    """
+    return CachedCrossEncoder(HuggingFaceCrossEncoder(model_name=model_name), max_entries)
+
+
+class TopKCompressor(BaseDocumentCompressor):
+    """
+    Keep the first documents of the fused result when there is no reranker.
+    """
+
+    top_n: int = 4
+
+    def compress_documents(self, documents, query, callbacks=None):
+        return list(documents)[:self.top_n]
+
+
+def build_retriever(vector_store, documents=None, k=4, fetch_k=DEFAULT_FETCH_K, lexical_weight=0.5,
+                    reranker=None):
+    """
+    Build a retriever fusing BM25 and vector search, with optional reranking.
+
+    Both retrievers fetch fetch_k candidates, which are merged by reciprocal
+    rank fusion. The reranker, or the fused order without one, then keeps
+    the k best chunks for the prompt.
+
+    Args:
+        vector_store (VectorStore): The vector store of the document.
+        documents (list): The chunks for the BM25 index, None for vector search only.
+        k (int): The number of chunks returned.
+        fetch_k (int): The number of candidates of every retriever.
+        lexical_weight (float): The weight of the BM25 results in the fusion, between 0 and 1.
+        reranker (BaseCrossEncoder): The cross-encoder ordering the candidates, None to skip reranking.
+
+    Returns:
+        BaseRetriever: The retriever.
+    """
+    fetch_k = max(fetch_k, k)
+    retriever = vector_store.as_retriever(search_kwargs={"k": fetch_k})
+    if documents:
+        lexical = BM25Retriever.from_documents(documents, preprocess_func=tokenize, k=fetch_k)
+        retriever = EnsembleRetriever(retrievers=[lexical, retriever],
+                                      weights=[lexical_weight, 1 - lexical_weight])
+    if reranker is not None:
+        compressor = CrossEncoderReranker(model=reranker, top_n=k)
+    else:
+        compressor = TopKCompressor(top_n=k)
+    return ContextualCompressionRetriever(base_compressor=compressor, base_retriever=retriever)
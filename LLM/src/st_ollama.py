@@ -1,70 +1,256 @@
-import ollama
-import streamlit as st
-
-# Set the title of the Streamlit app
-st.title("Let's Chat....🐼")
-
-
-def load_models():
-    """
-    Load the list of available Ollama models.
-
-    Returns:
-        list: A list of model names if successful, otherwise an empty list.
-    """
-    try:
-        model_list = [model["name"] for model in ollama.list()["models"]]
-        return model_list
-    except Exception as e:
-        st.error(f"Error loading models: {e}")
-        return []
-
-
-def generate_response(user_input, model):
-    """
-    Generate a response from the selected Ollama model based on user input.
-
-    Args:
-        user_input (str): The input text from the user.
-        model (str): The name of the selected model.
-
-    Yields:
-        str: The generated response content.
-    """
-    try:
-        response = ollama.chat(
-            model=model,
-            messages=[
-                {
-                    'role': 'user',
-                    'content': user_input,
-                },
-            ],
-            stream=True,
-        )
-        for res in response:
-            yield res["message"]["content"]
-    except Exception as e:
-        st.error(f"Error generating response: {e}")
-
-
-# Load Ollama models
-model_list = load_models()
-
-# Validate if models are loaded
-if model_list:
-    model = st.selectbox("Choose a model from the list", model_list)
-else:
-    st.stop()  # Stop execution if models are not loaded
-
-# Get user input from chat
-chat_input = st.chat_input("Hi, How are you?")
-
-# Validate user input
-if chat_input:
-    with st.spinner("Running....🐎"):
-        with st.chat_message("user"):
-            st.markdown(chat_input)
-
-        # Stream the generated response
-        st.write_stream(generate_response(chat_input, model))
+import threading
+import time
+
+import ollama
+import streamlit as st
+
+# How long the list of installed models is reused before Ollama is asked again
+MODEL_LIST_TTL = 60
+# How long Ollama keeps a model in memory after its last request
+KEEP_ALIVE = "30m"
+KEEP_ALIVE_SECONDS = 30 * 60
+# Size of the conversation history sent with every prompt
+MAX_HISTORY_CHARS = 8000
+
+# Set the title of the Streamlit app
+st.title("Let's Chat....🐼")
+
+
+class ModelRouter:
+    """
+    Track the resident models and pick one of them for every prompt.
+
+    The router lives in a cached resource, so the latency statistics and the
+    warmed up models are shared by all sessions of the Streamlit process.
+    """
+
+    def __init__(self, smoothing=0.3):
+        self._lock = threading.Lock()
+        self._smoothing = smoothing
+        self.first_token_latency = {}
+        # Time a model was last loaded or used, it is unloaded KEEP_ALIVE after that
+        self.last_used = {}
+
+    def record_latency(self, model, seconds):
+        """
+        Update the moving average of the time to the first token of a model and mark it as used.
+
+        Args:
+            model (str): The name of the model.
+            seconds (float): The measured time to the first token.
+        """
+        with self._lock:
+            self.last_used[model] = time.monotonic()
+            previous = self.first_token_latency.get(model)
+            self.first_token_latency[model] = seconds if previous is None else (
+                self._smoothing * seconds + (1 - self._smoothing) * previous)
+
+    def warmup(self, model):
+        """
+        Load a model into memory in the background, so the first prompt does not pay a cold load.
+
+        A model used within KEEP_ALIVE is still resident and is not loaded again.
+
+        Args:
+            model (str): The name of the model.
+        """
+        with self._lock:
+            last_used = self.last_used.get(model)
+            if last_used is not None and time.monotonic() - last_used < KEEP_ALIVE_SECONDS:
+                return
+            self.last_used[model] = time.monotonic()
+
+        def load():
+            try:
+                # An empty prompt only loads the model and keeps it resident
+                ollama.generate(model=model, prompt="", keep_alive=KEEP_ALIVE)
+            except Exception as e:
+                print(f"Warmup of {model} failed: {e}")
+                with self._lock:
+                    self.last_used.pop(model, None)
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def route(self, user_input, models, sizes, long_prompt_chars, latency_target):
+        """
+        Choose the model that answers a prompt.
+
+        Long prompts go to the largest model. Other prompts go to the largest
+        model whose average time to the first token meets the latency target,
+        or to the smallest model if there is no target.
+
+        Args:
+            user_input (str): The input text from the user.
+            models (list): The names of the models in the pool.
+            sizes (dict): The size in bytes of every model.
+            long_prompt_chars (int): The prompt length from which a prompt counts as long.
+            latency_target (float): The time to the first token to meet in seconds, 0 for none.
+
+        Returns:
+            str: The name of the selected model.
+        """
+        ordered = sorted(models, key=lambda name: sizes.get(name, 0))
+        if len(user_input) >= long_prompt_chars:
+            return ordered[-1]
+        if latency_target > 0:
+            with self._lock:
+                # Models without measurements yet are tried optimistically
+                fast_enough = [name for name in ordered
+                               if self.first_token_latency.get(name, 0.0) <= latency_target]
+            return fast_enough[-1] if fast_enough else ordered[0]
+        return ordered[0]
+
+
+@st.cache_resource
+def get_router():
+    return ModelRouter()
+
+
+@st.cache_data(ttl=MODEL_LIST_TTL, show_spinner=False)
+def list_models():
+    """
+    List the installed Ollama models, refreshed at most every MODEL_LIST_TTL seconds.
+
+    Returns:
+        dict: The size in bytes of every model, keyed by model name.
+    """
+    return {model["name"]: model.get("size", 0) for model in ollama.list()["models"]}
+
+
+def load_models():
+    """
+    Load the list of available Ollama models.
+
+    Returns:
+        dict: The size of every model if successful, otherwise an empty dict.
+    """
+    try:
+        return list_models()
+    except Exception as e:
+        st.error(f"Error loading models: {e}")
+        return {}
+
+
+def history_window(messages, start, max_chars=MAX_HISTORY_CHARS):
+    """
+    Find the first message of the history that is sent to the model.
+
+    The window only moves once the history outgrows max_chars, and then it
+    drops enough old turns to halve it. Between two moves every prompt
+    extends the previous one, so Ollama reuses the cached prompt prefix of
+    the resident model and only the new turn has to be processed.
+
+    Args:
+        messages (list): The whole conversation of the session.
+        start (int): The first message of the current window.
+        max_chars (int): The maximum size of the window in characters.
+
+    Returns:
+        int: The first message of the window to use.
+    """
+    if sum(len(message["content"]) for message in messages[start:]) <= max_chars:
+        return start
+
+    new_start = len(messages) - 1
+    kept_chars = len(messages[new_start]["content"])
+    while new_start > start and kept_chars + len(messages[new_start - 1]["content"]) <= max_chars // 2:
+        new_start -= 1
+        kept_chars += len(messages[new_start]["content"])
+
+    # The window always starts with a user turn
+    while new_start < len(messages) - 1 and messages[new_start]["role"] != "user":
+        new_start += 1
+    return new_start
+
+
+def generate_response(messages, model):
+    """
+    Generate a response from the selected Ollama model based on the conversation.
+
+    Args:
+        messages (list): The conversation window, ending with the new user input.
+        model (str): The name of the selected model.
+
+    Yields:
+        str: The generated response content.
+    """
+    try:
+        start_time = time.perf_counter()
+        response = ollama.chat(
+            model=model,
+            messages=messages,
+            stream=True,
+            keep_alive=KEEP_ALIVE,
+        )
+        first_token = True
+        for res in response:
+            if first_token:
+                get_router().record_latency(model, time.perf_counter() - start_time)
+                first_token = False
+            yield res["message"]["content"]
+    except Exception as e:
+        st.error(f"Error generating response: {e}")
+
+
+# Load Ollama models
+model_sizes = load_models()
+
+# Validate if models are loaded
+if not model_sizes:
+    st.stop()  # Stop execution if models are not loaded
+
+model_list = list(model_sizes)
+router = get_router()
+
+with st.sidebar:
+    model_pool = st.multiselect("Resident models", model_list, default=model_list[:1])
+    routing = st.radio("Routing", ("Manual", "Automatic"))
+    if routing == "Automatic":
+        long_prompt_chars = st.number_input("Long prompt from (characters)", min_value=1, value=500)
+        latency_target = st.number_input("Time to first token target (s), 0 for none", min_value=0.0, value=0.0)
+
+if not model_pool:
+    st.stop()
+
+# Keep every model of the pool loaded, so switching between them is cheap
+for pooled_model in model_pool:
+    router.warmup(pooled_model)
+
+if routing == "Manual":
+    model = st.selectbox("Choose a model from the list", model_pool)
+
+# The conversation is kept per session, history_start marks the window sent to the model
+if "messages" not in st.session_state:
+    st.session_state.messages = []
+    st.session_state.history_start = 0
+
+if st.sidebar.button("Clear conversation"):
+    st.session_state.messages = []
+    st.session_state.history_start = 0
+
+for message in st.session_state.messages:
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+
+# Get user input from chat
+chat_input = st.chat_input("Hi, How are you?")
+
+# Validate user input
+if chat_input:
+    if routing == "Automatic":
+        model = router.route(chat_input, model_pool, model_sizes, long_prompt_chars, latency_target)
+        st.caption(f"Routed to {model}")
+
+    with st.spinner("Running....🐎"):
+        with st.chat_message("user"):
+            st.markdown(chat_input)
+
+        st.session_state.messages.append({'role': 'user', 'content': chat_input})
+        st.session_state.history_start = history_window(
+            st.session_state.messages, st.session_state.history_start)
+
+        # Stream the generated response
+        with st.chat_message("assistant"):
+            answer = st.write_stream(generate_response(
+                st.session_state.messages[st.session_state.history_start:], model))
+        st.session_state.messages.append({'role': 'assistant', 'content': answer})
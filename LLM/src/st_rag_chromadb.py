@@ -1,219 +1,591 @@
-from langchain import chains, text_splitter, PromptTemplate
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_community import document_loaders, embeddings, vectorstores, llms
-import streamlit as st
-import time
-import os
-import warnings
-import ollama
-
-warnings.filterwarnings("ignore")
-
-OLLAMA_BASE_URL = "http://localhost:11434"
-VECTOR_DB_DIR = "vector_dbs"
-
-st.header("LLM Rag 🐻‍❄️")
-
-models = [model["name"] for model in ollama.list()["models"]]
-model = st.selectbox("Choose a model from the list", models)
-
-# Input text to load the document
-url_path = st.text_input("Enter the URL to load for RAG:", key="url_path")
-
-# Select embedding type
-embedding_type = st.selectbox(
-    "Please select an embedding type",
-    ("ollama",
-     "huggingface",
-     "nomic",
-     "fastembed"),
-    index=1)
-
-# Input for RAG
-question = st.text_input(
-    "Enter the question for RAG:",
-    value="What is this about",
-    key="question")
-
-
-def load_document(url):
-    """
-    Load the document from the specified URL.
-
-    Args:
-        url (str): The URL of the document to load.
-
-    Returns:
-        Document: The loaded document.
-    """
-    print("Loading document from URL...")
-    st.markdown(''' :green[Loading document from URL...] ''')
-    loader = document_loaders.WebBaseLoader(url)
-    return loader.load()
-
-
-def split_document(text, chunk_size=3000, overlap=200):
-    """
-    Split the document into multiple chunks.
-
-    Args:
-        text (str): The text of the document to split.
-        chunk_size (int): The size of each chunk.
-        overlap (int): The overlap between chunks.
-
-    Returns:
-        list: A list of document chunks.
-    """
-    print("Splitting document into chunks...")
-    st.markdown(''' :green[Splitting document into chunks...] ''')
-    text_splitter_instance = text_splitter.RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=overlap)
-    return text_splitter_instance.split_documents(text)
-
-
-def initialize_embedding_fn(
-        embedding_type="huggingface",
-        model_name="sentence-transformers/all-MiniLM-l6-v2"):
-    """
-    Initialize the embedding function based on the specified type.
-
-    Args:
-        embedding_type (str): The type of embedding to use.
-        model_name (str): The name of the model to use for embeddings.
-
-    Returns:
-        Embeddings: The initialized embedding function.
-    """
-    print(f"Initializing {embedding_type} model with {model_name}...")
-    st.write(f"Initializing {embedding_type} model with {model_name}...")
-    if embedding_type == "ollama":
-        model_name = chat_model
-        return embeddings.OllamaEmbeddings(
-            model=model_name, base_url=OLLAMA_BASE_URL)
-    elif embedding_type == "huggingface":
-        model_name = "sentence-transformers/paraphrase-MiniLM-L3-v2"
-        return embeddings.HuggingFaceEmbeddings(model_name=model_name)
-    elif embedding_type == "nomic":
-        return embeddings.NomicEmbeddings(model_name=model_name)
-    elif embedding_type == "fastembed":
-        return FastEmbedEmbeddings(threads=16)
-    else:
-        raise ValueError(f"Unsupported embedding type: {embedding_type}")
-
-
-def get_or_create_embeddings(
-        document_url,
-        embedding_fn,
-        persist_dir=VECTOR_DB_DIR):
-    """
-    Create embeddings for the document chunks and store them in a vector database.
-
-    Args:
-        document_url (str): The URL of the document.
-        embedding_fn (Embeddings): The embedding function to use.
-        persist_dir (str): The directory to persist the vector database.
-
-    Returns:
-        VectorStore: The created vector store.
-    """
-    vector_store_path = os.path.join(os.getcwd(), persist_dir)
-    start_time = time.time()
-    print("No existing vector store found. Creating new one...")
-    st.markdown(
-        ''' :green[No existing vector store found. Creating new one......] ''')
-    document = load_document(document_url)
-    documents = split_document(document)
-    vector_store = vectorstores.Chroma.from_documents(
-        documents=documents,
-        embedding=embedding_fn,
-        persist_directory=persist_dir
-    )
-    vector_store.persist()
-    print(f"Embedding time: {time.time() - start_time:.2f} seconds")
-    st.write(f"Embedding time: {time.time() - start_time:.2f} seconds")
-    return vector_store
-
-
-def handle_user_interaction(vector_store, chat_model):
-    """
-    Handle user interaction by generating a response based on the user's question.
-
-    Args:
-        vector_store (VectorStore): The vector store containing document embeddings.
-        chat_model (LLM): The language model to generate responses.
-
-    Returns:
-        str: The generated response.
-    """
-    prompt_template = """
-    Use the following pieces of context to answer the question at the end.
-    If you do not know the answer, answer 'I don't know', limit your response to the answer and nothing more.
-
-    {context}
-
-    Question: {question}
-    """
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=[
-            "context",
-            "question"])
-    chain_type_kwargs = {"prompt": prompt}
-    st.markdown(
-        ''' :green[Using retrievers to retrieve the data from the database...] ''')
-    retriever = vector_store.as_retriever(search_kwargs={"k": 4})
-    st.markdown(''' :green[Answering the query...] ''')
-    qachain = chains.RetrievalQA.from_chain_type(
-        llm=chat_model,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs=chain_type_kwargs)
-    qachain.invoke({"query": "what is this about?"})
-    print(f"Model warmup complete...")
-    st.markdown(''' :green[Model warmup complete...] ''')
-
-    start_time = time.time()
-    answer = qachain.invoke({"query": question})
-    print(f"Answer: {answer['result']}")
-    print(f"Response time: {time.time() - start_time:.2f} seconds")
-    st.write(f"Response time: {time.time() - start_time:.2f} seconds")
-
-    return answer['result']
-
-
-def getfinalresponse(document_url, embedding_type, chat_model):
-    """
-    Main function to load the document, initialize the embeddings, create the vector database, and invoke the model.
-
-    Args:
-        document_url (str): The URL of the document.
-        embedding_type (str): The type of embedding to use.
-        chat_model (str): The name of the chat model to use.
-
-    Returns:
-        str: The final response generated by the model.
-    """
-    try:
-        document_url = url_path
-        chat_model = model
-
-        embedding_fn = initialize_embedding_fn(embedding_type)
-        vector_store = get_or_create_embeddings(document_url, embedding_fn)
-        chat_model_instance = llms.Ollama(
-            base_url=OLLAMA_BASE_URL, model=chat_model)
-        return handle_user_interaction(vector_store, chat_model_instance)
-    except Exception as e:
-        st.error(f"An error occurred: {e}")
-        return None
-
-
-submit = st.button("Generate")
-
-if submit:
-    if not url_path.strip():
-        st.error("Please enter a valid URL.")
-    elif not question.strip():
-        st.error("Please enter a valid question.")
-    else:
-        with st.spinner("Loading document....🐎"):
-            st.write(getfinalresponse(url_path, embedding_type, model))
+from langchain import chains, text_splitter, PromptTemplate
+from langchain_community import document_loaders, vectorstores, llms
+import rag_embeddings
+import rag_cache
+import rag_ingest
+import rag_retrieval
+import streamlit as st
+import hashlib
+import json
+import time
+import os
+import warnings
+import ollama
+
+warnings.filterwarnings("ignore")
+
+OLLAMA_BASE_URL = rag_embeddings.OLLAMA_BASE_URL
+VECTOR_DB_DIR = "vector_dbs"
+# Lists the stores of VECTOR_DB_DIR with the document and settings they were built from
+CATALOG_FILE = "catalog.json"
+CHUNK_SIZE = 3000
+CHUNK_OVERLAP = 200
+EMBEDDING_CACHE_DIR = rag_embeddings.EMBEDDING_CACHE_DIR
+
+st.header("LLM Rag 🐻‍❄️")
+
+models = [model["name"] for model in ollama.list()["models"]]
+model = st.selectbox("Choose a model from the list", models)
+
+# Input text to load the document
+url_path = st.text_input(
+    "Enter the URL to load for RAG (several URLs or a sitemap .xml build a knowledge base):", key="url_path")
+ingest_concurrency = st.sidebar.number_input(
+    "Pages downloaded at once", min_value=1, value=rag_ingest.DEFAULT_CONCURRENCY)
+
+# Select embedding type
+embedding_type = st.selectbox(
+    "Please select an embedding type",
+    rag_embeddings.EMBEDDING_TYPES,
+    index=1)
+embedding_batch_size = st.sidebar.number_input(
+    "Embedding batch size", min_value=1, value=rag_embeddings.DEFAULT_BATCH_SIZE)
+embedding_threads = st.sidebar.number_input(
+    "Embedding threads", min_value=1, value=rag_embeddings.DEFAULT_THREADS)
+
+# Stores of known documents are opened without loading the URL again, unless asked to
+refresh_document = st.checkbox("Check the document for changes", value=False)
+# The first question of the process otherwise also pays for loading the chat model
+warmup_model = st.checkbox("Warm up the chat model once", value=True)
+
+# Retrieval settings, fewer and better chunks keep the prompt short
+hybrid_retrieval = st.sidebar.checkbox("Hybrid retrieval (BM25 and vectors)", value=True)
+rerank = st.sidebar.checkbox("Rerank with a cross-encoder", value=False)
+context_chunks = st.sidebar.number_input("Chunks in the prompt", min_value=1, value=4)
+# Repeated questions reuse the retrieved chunks and the answer
+cache_results = st.sidebar.checkbox("Cache retrieval and answers", value=True)
+question_similarity = st.sidebar.slider(
+    "Similarity of a repeated question (1 for exact matches only)",
+    min_value=0.8, max_value=1.0, value=rag_cache.DEFAULT_SIMILARITY)
+
+# Input for RAG
+question = st.text_input(
+    "Enter the question for RAG:",
+    value="What is this about",
+    key="question")
+
+
+def load_document(url):
+    """
+    Load the document from the specified URL.
+
+    Args:
+        url (str): The URL of the document to load.
+
+    Returns:
+        Document: The loaded document.
+    """
+    print("Loading document from URL...")
+    st.markdown(''' :green[Loading document from URL...] ''')
+    loader = document_loaders.WebBaseLoader(url)
+    return loader.load()
+
+
+def split_document(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split the document into multiple chunks.
+
+    Args:
+        text (str): The text of the document to split.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+
+    Returns:
+        list: A list of document chunks.
+    """
+    print("Splitting document into chunks...")
+    st.markdown(''' :green[Splitting document into chunks...] ''')
+    text_splitter_instance = text_splitter.RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=overlap)
+    return text_splitter_instance.split_documents(text)
+
+
+@st.cache_resource(show_spinner=False)
+def load_embedding_backend(embedding_type, model_name):
+    # Loaded once per process for every type and model, whatever the batch size and threads
+    return rag_embeddings.load_embedding_backend(embedding_type, model_name)
+
+
+def initialize_embedding_fn(
+        embedding_type="huggingface",
+        model_name=None,
+        batch_size=rag_embeddings.DEFAULT_BATCH_SIZE,
+        threads=rag_embeddings.DEFAULT_THREADS):
+    """
+    Initialize the embedding function based on the specified type.
+
+    The model is loaded once per process for every embedding type and
+    model, so neither reruns nor other batch sizes and thread counts load
+    the weights again. Chunk embeddings are cached on disk by model and
+    chunk text.
+
+    Args:
+        embedding_type (str): The type of embedding to use.
+        model_name (str): The name of the model to use for embeddings, None for the default of the type.
+        batch_size (int): The number of chunks embedded together.
+        threads (int): The number of CPU threads of the embedding backend.
+
+    Returns:
+        Embeddings: The initialized embedding function.
+    """
+    model_name = model_name or rag_embeddings.DEFAULT_EMBEDDING_MODELS.get(embedding_type)
+    backend = load_embedding_backend(embedding_type, model_name)
+    embedding_fn = rag_embeddings.TunedEmbeddings(backend, batch_size, threads)
+    # Chunks embedded before, by any document, are read from the cache instead
+    cache = rag_embeddings.get_embedding_cache(EMBEDDING_CACHE_DIR, f"{embedding_type}:{model_name}")
+    return rag_embeddings.CachedEmbeddings(embedding_fn, cache, model_name=model_name)
+
+
+def load_catalog(persist_dir=VECTOR_DB_DIR):
+    """
+    Load the catalog of the vector stores in the persist directory.
+
+    Args:
+        persist_dir (str): The directory of the vector databases.
+
+    Returns:
+        dict: The catalog entries, keyed by store key.
+    """
+    try:
+        with open(os.path.join(persist_dir, CATALOG_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_catalog(catalog, persist_dir=VECTOR_DB_DIR):
+    """
+    Save the catalog, replacing the previous one only once it is completely written.
+
+    Args:
+        catalog (dict): The catalog entries, keyed by store key.
+        persist_dir (str): The directory of the vector databases.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, CATALOG_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def store_key(document_url, embedding_type, embedding_model, chunk_size, overlap):
+    """
+    Identify the vector store of a document.
+
+    Vectors of different embedding models, or chunks of different sizes,
+    never end up in the same store.
+
+    Returns:
+        str: The key of the store in the catalog, also used as collection name.
+    """
+    settings = json.dumps([document_url, embedding_type, embedding_model, chunk_size, overlap])
+    return "rag-" + hashlib.sha256(settings.encode()).hexdigest()[:32]
+
+
+def content_hash(documents):
+    """
+    Hash the text of the loaded document.
+
+    Args:
+        documents (list): The loaded documents.
+
+    Returns:
+        str: The SHA-256 of the text of all documents.
+    """
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(document.page_content.encode())
+    return digest.hexdigest()
+
+
+def chunk_ids(chunks):
+    """
+    Give every chunk an id derived from its text, so unchanged chunks keep their id.
+
+    Args:
+        chunks (list): The document chunks.
+
+    Returns:
+        dict: The chunks keyed by id, without duplicated chunks.
+    """
+    return {hashlib.sha256(chunk.page_content.encode()).hexdigest(): chunk for chunk in chunks}
+
+
+def get_or_create_embeddings(
+        document_url,
+        embedding_fn,
+        embedding_type="huggingface",
+        persist_dir=VECTOR_DB_DIR,
+        refresh=False,
+        chunk_size=CHUNK_SIZE,
+        overlap=CHUNK_OVERLAP):
+    """
+    Open the vector store of the document, or create it.
+
+    A store listed in the catalog is opened without loading the document.
+    With refresh, the document is loaded again and, if its content changed,
+    only the new chunks are embedded and the chunks that disappeared are
+    deleted.
+
+    Args:
+        document_url (str): The URL of the document.
+        embedding_fn (Embeddings): The embedding function to use.
+        embedding_type (str): The type of embedding, part of the store key.
+        persist_dir (str): The directory to persist the vector database.
+        refresh (bool): Load the document again and update the store if it changed.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+
+    Returns:
+        VectorStore: The vector store of the document.
+    """
+    start_time = time.time()
+    embedding_model = getattr(embedding_fn, "model_name", None) or getattr(embedding_fn, "model", None)
+    key = store_key(document_url, embedding_type, embedding_model, chunk_size, overlap)
+    catalog = load_catalog(persist_dir)
+    entry = catalog.get(key)
+    vector_store = vectorstores.Chroma(
+        collection_name=key,
+        embedding_function=embedding_fn,
+        persist_directory=persist_dir
+    )
+
+    if entry is not None and not refresh:
+        print("Using existing vector store...")
+        st.markdown(''' :green[Using existing vector store...] ''')
+        return vector_store
+
+    document = load_document(document_url)
+    document_hash = content_hash(document)
+    if entry is not None and entry["content_hash"] == document_hash:
+        print("Document unchanged, using existing vector store...")
+        st.markdown(''' :green[Document unchanged, using existing vector store...] ''')
+        return vector_store
+
+    if entry is None:
+        print("No existing vector store found. Creating new one...")
+        st.markdown(
+            ''' :green[No existing vector store found. Creating new one......] ''')
+    else:
+        print("Document changed, updating vector store...")
+        st.markdown(''' :green[Document changed, updating vector store...] ''')
+    chunks = chunk_ids(split_document(document, chunk_size, overlap))
+    stored_ids = set(vector_store.get(include=[])["ids"])
+    removed_ids = list(stored_ids - chunks.keys())
+    added_ids = [chunk_id for chunk_id in chunks if chunk_id not in stored_ids]
+    if removed_ids:
+        vector_store.delete(ids=removed_ids)
+    if added_ids:
+        hits = getattr(embedding_fn, "hits", 0)
+        vector_store.add_documents([chunks[chunk_id] for chunk_id in added_ids], ids=added_ids)
+        if hasattr(embedding_fn, "hits"):
+            st.write(f"Embedding cache hits: {embedding_fn.hits - hits} of {len(added_ids)} chunks")
+    vector_store.persist()
+
+    catalog[key] = {
+        "url": document_url,
+        "embedding_type": embedding_type,
+        "embedding_model": embedding_model,
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "content_hash": document_hash,
+        "chunks": len(chunks),
+        "updated": time.time(),
+    }
+    save_catalog(catalog, persist_dir)
+    print(f"Embedded {len(added_ids)} new chunks, removed {len(removed_ids)} chunks")
+    st.write(f"Embedded {len(added_ids)} new chunks, removed {len(removed_ids)} chunks")
+    print(f"Embedding time: {time.time() - start_time:.2f} seconds")
+    st.write(f"Embedding time: {time.time() - start_time:.2f} seconds")
+    return vector_store
+
+
+def get_or_create_knowledge_base(
+        urls,
+        embedding_fn,
+        embedding_type="huggingface",
+        persist_dir=VECTOR_DB_DIR,
+        refresh=False,
+        chunk_size=CHUNK_SIZE,
+        overlap=CHUNK_OVERLAP,
+        concurrency=rag_ingest.DEFAULT_CONCURRENCY):
+    """
+    Open the vector store of a list of pages or sitemaps, or ingest the pages into a new one.
+
+    The pages are downloaded concurrently, split on a process pool and
+    embedded in batches, all at the same time. With refresh, every page is
+    ingested again and the chunks no page contains anymore are deleted.
+
+    Args:
+        urls (list): Page URLs and sitemap URLs.
+        embedding_fn (Embeddings): The embedding function to use.
+        embedding_type (str): The type of embedding, part of the store key.
+        persist_dir (str): The directory to persist the vector database.
+        refresh (bool): Ingest the pages again.
+        chunk_size (int): The size of each chunk.
+        overlap (int): The overlap between chunks.
+        concurrency (int): The number of pages downloaded at the same time.
+
+    Returns:
+        VectorStore: The vector store of the pages.
+    """
+    embedding_model = getattr(embedding_fn, "model_name", None) or getattr(embedding_fn, "model", None)
+    source = "\n".join(sorted(urls))
+    key = store_key(source, embedding_type, embedding_model, chunk_size, overlap)
+    catalog = load_catalog(persist_dir)
+    vector_store = vectorstores.Chroma(
+        collection_name=key,
+        embedding_function=embedding_fn,
+        persist_directory=persist_dir
+    )
+    if key in catalog and not refresh:
+        print("Using existing knowledge base...")
+        st.markdown(''' :green[Using existing knowledge base...] ''')
+        return vector_store
+
+    print(f"Ingesting pages of {len(urls)} URLs...")
+    st.markdown(''' :green[Ingesting pages...] ''')
+    stored_ids = set(vector_store.get(include=[])["ids"])
+    add_chunks, ingested_ids = rag_ingest.vector_store_writer(vector_store)
+    stats = rag_ingest.ingest(
+        urls, add_chunks, concurrency=concurrency, chunk_size=chunk_size, overlap=overlap)
+    removed_ids = list(stored_ids - ingested_ids)
+    if removed_ids and stats.failed == 0:
+        vector_store.delete(ids=removed_ids)
+    vector_store.persist()
+
+    catalog[key] = {
+        "url": source,
+        "embedding_type": embedding_type,
+        "embedding_model": embedding_model,
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "content_hash": None,
+        "pages": stats.pages,
+        "chunks": len(ingested_ids),
+        "updated": time.time(),
+    }
+    save_catalog(catalog, persist_dir)
+    print(f"Ingested {stats.summary()}")
+    st.write(f"Ingested {stats.summary()}")
+    return vector_store
+
+
+@st.cache_resource
+def get_chat_model(chat_model):
+    """
+    Create the Ollama client of a chat model once per process.
+
+    Args:
+        chat_model (str): The name of the chat model.
+
+    Returns:
+        LLM: The language model client.
+    """
+    return llms.Ollama(base_url=OLLAMA_BASE_URL, model=chat_model)
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up_model(chat_model):
+    """
+    Load the chat model into Ollama with a short prompt, once per process and model.
+
+    Args:
+        chat_model (str): The name of the chat model.
+
+    Returns:
+        float: The warmup time in seconds.
+    """
+    start_time = time.time()
+    get_chat_model(chat_model).invoke("Hello")
+    print(f"Model warmup complete...")
+    return time.time() - start_time
+
+
+@st.cache_resource(show_spinner=False)
+def get_reranker(model_name=rag_retrieval.DEFAULT_RERANK_MODEL):
+    # The scores of the cross-encoder are cached with it, for all sessions of the process
+    return rag_retrieval.load_reranker(model_name)
+
+
+@st.cache_resource(show_spinner=False)
+def get_retriever(store_id, updated, hybrid, reranked, k, _vector_store):
+    """
+    Build the retriever of a vector store once per process and version of the store.
+
+    The BM25 index is built from the chunks of the store, so it always
+    matches the vectors.
+
+    Args:
+        store_id (str): The name of the collection of the vector store, the cache key of the store.
+        updated (float): The last update of the store in the catalog, a new version builds a new index.
+        hybrid (bool): Fuse BM25 and vector search.
+        reranked (bool): Rerank the candidates with a cross-encoder.
+        k (int): The number of chunks in the prompt.
+        _vector_store (VectorStore): The vector store containing document embeddings.
+
+    Returns:
+        BaseRetriever: The retriever.
+    """
+    documents = rag_retrieval.stored_documents(_vector_store) if hybrid else None
+    return rag_retrieval.build_retriever(
+        _vector_store, documents, k=k, reranker=get_reranker() if reranked else None)
+
+
+@st.cache_resource
+def get_qa_chain(store_id, chat_model, _retriever):
+    """
+    Build the question answering chain of a retriever and chat model once per process.
+
+    Args:
+        store_id (str): The cache key of the retriever.
+        chat_model (str): The name of the chat model.
+        _retriever (BaseRetriever): The retriever of the document chunks.
+
+    Returns:
+        RetrievalQA: The question answering chain.
+    """
+    prompt_template = """
+    Use the following pieces of context to answer the question at the end.
+    If you do not know the answer, answer 'I don't know', limit your response to the answer and nothing more.
+
+    {context}
+
+    Question: {question}
+    """
+    prompt = PromptTemplate(
+        template=prompt_template,
+        input_variables=[
+            "context",
+            "question"])
+    chain_type_kwargs = {"prompt": prompt}
+    return chains.RetrievalQA.from_chain_type(
+        llm=get_chat_model(chat_model),
+        retriever=_retriever,
+        chain_type="stuff",
+        chain_type_kwargs=chain_type_kwargs)
+
+
+@st.cache_resource
+def get_result_caches():
+    """
+    Create the retrieval and answer caches shared by all sessions of the process.
+
+    Returns:
+        tuple: The cache of retrieved chunks and the cache of answers.
+    """
+    return rag_cache.ResultCache(), rag_cache.ResultCache()
+
+
+def handle_user_interaction(vector_store, chat_model, warmup=True):
+    """
+    Handle user interaction by generating a response based on the user's question.
+
+    With caching, the chunks retrieved for a question are cached per store
+    and retrieval settings, and the answer per retrieved chunks and chat
+    model. Both caches also match near-identical questions by the
+    similarity of their embeddings.
+
+    Args:
+        vector_store (VectorStore): The vector store containing document embeddings.
+        chat_model (str): The name of the chat model to generate responses.
+        warmup (bool): Load the chat model before the first question of the process.
+
+    Returns:
+        str: The generated response.
+    """
+    if warmup:
+        warm_up_model(chat_model)
+        st.markdown(''' :green[Model warmup complete...] ''')
+
+    start_time = time.time()
+    store_id = vector_store._collection.name
+    updated = load_catalog().get(store_id, {}).get("updated")
+    retriever = get_retriever(store_id, updated, hybrid_retrieval, rerank, context_chunks, vector_store)
+    qachain = get_qa_chain(
+        f"{store_id}:{updated}:{hybrid_retrieval}:{rerank}:{context_chunks}", chat_model, retriever)
+
+    retrieval_cache, answer_cache = get_result_caches()
+    query = rag_cache.normalize_query(question)
+    similarity = question_similarity if question_similarity < 1.0 else None
+    query_embedding = vector_store.embeddings.embed_query(question) if cache_results and similarity else None
+    store_namespace = (store_id, updated, hybrid_retrieval, rerank, context_chunks)
+
+    st.markdown(
+        ''' :green[Using retrievers to retrieve the data from the database...] ''')
+    documents = retrieval_cache.get(store_namespace, query, query_embedding, similarity) if cache_results else None
+    if documents is None:
+        documents = retriever.invoke(question)
+        if cache_results:
+            retrieval_cache.put(store_namespace, query, documents, query_embedding)
+
+    st.markdown(''' :green[Answering the query...] ''')
+    chunk_ids = tuple(rag_ingest.chunk_id(document.page_content) for document in documents)
+    answer_namespace = (chunk_ids, chat_model)
+    answer = answer_cache.get(answer_namespace, query, query_embedding, similarity) if cache_results else None
+    if answer is None:
+        answer = qachain.combine_documents_chain.invoke(
+            {"input_documents": documents, "question": question})["output_text"]
+        if cache_results:
+            answer_cache.put(answer_namespace, query, answer, query_embedding)
+
+    print(f"Answer: {answer}")
+    print(f"Response time: {time.time() - start_time:.2f} seconds")
+    st.write(f"Response time: {time.time() - start_time:.2f} seconds")
+    if cache_results:
+        retrieval_metrics, answer_metrics = retrieval_cache.metrics(), answer_cache.metrics()
+        st.sidebar.caption(
+            f"Retrieval cache hit rate: {retrieval_metrics['hit_rate']:.0%} "
+            f"({retrieval_metrics['exact_hits']} exact, {retrieval_metrics['similar_hits']} similar) · "
+            f"answer cache hit rate: {answer_metrics['hit_rate']:.0%} "
+            f"({answer_metrics['exact_hits']} exact, {answer_metrics['similar_hits']} similar)")
+
+    return answer
+
+
+def getfinalresponse(document_url, embedding_type, chat_model):
+    """
+    Main function to load the document, initialize the embeddings, create the vector database, and invoke the model.
+
+    Args:
+        document_url (str): The URL of the document.
+        embedding_type (str): The type of embedding to use.
+        chat_model (str): The name of the chat model to use.
+
+    Returns:
+        str: The final response generated by the model.
+    """
+    try:
+        document_url = url_path
+        chat_model = model
+
+        # The ollama embeddings use the selected chat model
+        embedding_fn = initialize_embedding_fn(
+            embedding_type,
+            model_name=chat_model if embedding_type == "ollama" else None,
+            batch_size=embedding_batch_size,
+            threads=embedding_threads)
+        urls = document_url.split()
+        if len(urls) > 1 or urls[0].endswith(".xml"):
+            vector_store = get_or_create_knowledge_base(
+                urls, embedding_fn, embedding_type=embedding_type, refresh=refresh_document,
+                concurrency=ingest_concurrency)
+        else:
+            vector_store = get_or_create_embeddings(
+                document_url, embedding_fn, embedding_type=embedding_type, refresh=refresh_document)
+        return handle_user_interaction(vector_store, chat_model, warmup=warmup_model)
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return None
+
+
+submit = st.button("Generate")
+
+if submit:
+    if not url_path.strip():
+        st.error("Please enter a valid URL.")
+    elif not question.strip():
+        st.error("Please enter a valid question.")
+    else:
+        with st.spinner("Loading document....🐎"):
+            st.write(getfinalresponse(url_path, embedding_type, model))
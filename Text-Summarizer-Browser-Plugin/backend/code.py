@@ -8,6 +8,22 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.document_loaders import WebBaseLoader, PyPDFLoader
+from langchain_community.retrievers import BM25Retriever
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from langchain_community.cross_encoders.base import BaseCrossEncoder
+from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+from langchain.retrievers.document_compressors import CrossEncoderReranker
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from collections import OrderedDict
+import os
+import re
+
+# Retrieval settings: chunks in the prompt, candidates of the BM25 and vector retrievers
+RETRIEVAL_K = 4
+FETCH_K = 10
+# Set USE_RERANKER=1 to order the candidates with a cross-encoder
+USE_RERANKER = os.environ.get("USE_RERANKER", "0") == "1"
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 # Prompt Templates for Summarization & QA Bot
 summary_template = """Write a concise summary of the following: "{context}" CONCISE SUMMARY: """
@@ -20,14 +36,79 @@ query_template = """Use the following pieces of context to answer the question a
     Helpful Answer:"""
 
 
+class CachedCrossEncoder(BaseCrossEncoder):
+    """
+        Wraps a cross-encoder so that every (question, chunk) pair is scored only once.
+        Follow-up questions on the same page mostly rerank the same chunks again.
+    """
+
+    def __init__(self, model, max_entries=10000):
+        self.model = model
+        self.max_entries = max_entries
+        self.scores = OrderedDict()
+
+    def score(self, text_pairs):
+        missing = [pair for pair in text_pairs if pair not in self.scores]
+        if missing:
+            for pair, score in zip(missing, self.model.score(missing)):
+                self.scores[pair] = float(score)
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+        return [self.scores[pair] for pair in text_pairs]
+
+
+class TopKCompressor(BaseDocumentCompressor):
+    """
+        Keeps the best RETRIEVAL_K chunks of the fused result when there is no reranker.
+    """
+    top_n: int = RETRIEVAL_K
+
+    def compress_documents(self, documents, query, callbacks=None):
+        return list(documents)[:self.top_n]
+
+
+reranker = None
+
+
+def get_reranker():
+    """
+        Loads the cross-encoder on first use.
+        output: the cached cross-encoder
+    """
+    global reranker
+    if reranker is None:
+        reranker = CachedCrossEncoder(HuggingFaceCrossEncoder(model_name=RERANK_MODEL))
+    return reranker
+
+
+def build_retriever(vectorstore, splits):
+    """
+        Builds a BM25 index over the page chunks and fuses its results with the vector search (reciprocal rank fusion).
+        The fused candidates are reranked with a cross-encoder if USE_RERANKER is set, and only the best RETRIEVAL_K chunks go into the prompt.
+        input: vectorstore of the page and its chunks
+        output: retriever
+    """
+    lexical = BM25Retriever.from_documents(
+        splits, preprocess_func=lambda text: re.findall(r"\w+", text.lower()), k=FETCH_K)
+    hybrid = EnsembleRetriever(
+        retrievers=[lexical, vectorstore.as_retriever(search_kwargs={"k": FETCH_K})],
+        weights=[0.5, 0.5])
+    if USE_RERANKER:
+        compressor = CrossEncoderReranker(model=get_reranker(), top_n=RETRIEVAL_K)
+    else:
+        compressor = TopKCompressor(top_n=RETRIEVAL_K)
+    return ContextualCompressionRetriever(base_compressor=compressor, base_retriever=hybrid)
+
+
 def pre_processing(loader):
     """
         This is a helper function which does the below steps in a sequential order:
         1. Loads page content from the URL/PDF
         2. Splits the page data using Recursive Character Text Splitter & creates embeddings using HuggingFace Embeddings
         3. This is further stored into ChromaDB then after for retrieval
+        4. Builds the hybrid BM25 + vector retriever over the same chunks
         input: Fetched RAW content from the input(URL/PDF).
-        output: returns a vectorstore
+        output: returns a vectorstore and its retriever
     """
     try:
         page_data = loader.load()
@@ -39,7 +120,7 @@ def pre_processing(loader):
         global vectorstore
         vectorstore = Chroma.from_documents(
             documents=all_splits, embedding=embeddings)
-        return vectorstore
+        return vectorstore, build_retriever(vectorstore, all_splits)
     except Exception as e:
         print("Error while processing Webpage/PDF page content\n")
         raise e
@@ -85,9 +166,9 @@ def pre_process_url_data(urls):
     """
     try:
         loader = WebBaseLoader(urls)
-        global summ_vectorstore
+        global summ_vectorstore, summ_retriever
         # Common Helper function for processing data.
-        summ_vectorstore = pre_processing(loader)
+        summ_vectorstore, summ_retriever = pre_processing(loader)
         prompt = PromptTemplate(
             template=summary_template,
             input_variables=["context", "question"]
@@ -95,7 +176,7 @@ def pre_process_url_data(urls):
 
         qa_chain = RetrievalQA.from_chain_type(
             llm=llm_model,
-            retriever=summ_vectorstore.as_retriever(),
+            retriever=summ_retriever,
             chain_type="stuff",
             chain_type_kwargs={"prompt": prompt},
             return_source_documents=False,
@@ -126,7 +207,7 @@ def qa_on_url_summarized_text(query):
         )
         reduce_chain = RetrievalQA.from_chain_type(
             llm=llm_model,
-            retriever=summ_vectorstore.as_retriever(),
+            retriever=summ_retriever,
             chain_type="stuff",
             chain_type_kwargs={"prompt": prompt},
             return_source_documents=False
@@ -152,8 +233,8 @@ def pre_process_pdf_data(pdf):
     """
     try:
         loader = PyPDFLoader(pdf, extract_images=False)
-        global pdf_vectorstore
-        pdf_vectorstore = pre_processing(loader)
+        global pdf_vectorstore, pdf_retriever
+        pdf_vectorstore, pdf_retriever = pre_processing(loader)
 
         prompt = PromptTemplate(
             template=summary_template,
@@ -161,7 +242,7 @@ def pre_process_pdf_data(pdf):
         )
         reduce_chain = RetrievalQA.from_chain_type(
             llm=llm_model,
-            retriever=pdf_vectorstore.as_retriever(),
+            retriever=pdf_retriever,
             chain_type="stuff",
             chain_type_kwargs={"prompt": prompt},
             return_source_documents=False,
@@ -192,7 +273,7 @@ def qa_on_pdf_summarized_text(query):
         )
         reduce_chain = RetrievalQA.from_chain_type(
             llm=llm_model,
-            retriever=pdf_vectorstore.as_retriever(),
+            retriever=pdf_retriever,
             chain_type="stuff",
             chain_type_kwargs={"prompt": prompt},
             return_source_documents=False